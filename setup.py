@@ -31,7 +31,7 @@ setup(
     author='Hugh Sorby',
     author_email='h.sorby@auckland.ac.nz',
     description='A simple test harness for running Python generated code from libCellML.',
-    install_requires=['matplotlib', 'scipy'],
+    install_requires=['matplotlib', 'numpy', 'scipy'],
     entry_points={
         'console_scripts': ['cellsolver=cellsolver.main:main'],
     }
@@ -0,0 +1,120 @@
+import time
+
+import numpy as np
+
+from cellsolver.external_data import ExternalData
+from cellsolver.solvers import solve, system_has_external_variables, system_solver
+from cellsolver.utilities import load_cache, module_hash, save_cache, solution_error
+
+CACHE_FILE = 'auto_solver_cache.json'
+
+STIFFNESS_RATIO_THRESHOLD = 1e3
+PROBE_FRACTION = 0.1
+REFERENCE_INTEGRATOR = ('lsoda', {'rtol': 1e-10, 'atol': 1e-12, 'nsteps': 100000})
+
+NON_STIFF_CANDIDATES = [('euler', {}), ('dopri5', {}), ('dop853', {}), ('lsoda', {})]
+STIFF_CANDIDATES = [('vode', {'method': 'bdf'}), ('lsoda', {})]
+
+
+def rates_function(system, external_module=None):
+    """Return f(t, y) evaluating the rates of the system with its constants initialised."""
+    solver_module = system_solver(system)
+    if system_has_external_variables(system):
+        states, rates, variables = solver_module.initialize_system(system, external_module.initialise_external_variable)
+        update_arguments = (external_module.update_external_variable,)
+    else:
+        states, rates, variables = solver_module.initialize_system(system)[:3]
+        update_arguments = ()
+
+    def f(t, y):
+        return list(solver_module.update(t, list(y), system, rates, variables, *update_arguments))
+
+    return f, states
+
+
+def stiffness_ratio(system, t=0.0, external_module=None):
+    """Estimate the stiffness ratio max|Re(lambda)| / min|Re(lambda)| of the Jacobian at the initial state.
+
+    The Jacobian is approximated with forward differences, eigenvalues with a negligible real part
+    are ignored.  Returns 1.0 when fewer than two eigenvalues remain.
+    """
+    f, states = rates_function(system, external_module)
+    y = np.array(states, dtype=float)
+    f_0 = np.array(f(t, y))
+    jacobian = np.empty((len(y), len(y)))
+    for j in range(len(y)):
+        h = np.sqrt(np.finfo(float).eps) * max(1.0, abs(y[j]))
+        y_h = y.copy()
+        y_h[j] += h
+        jacobian[:, j] = (np.array(f(t, y_h)) - f_0) / h
+
+    real_parts = np.abs(np.linalg.eigvals(jacobian).real)
+    real_parts = real_parts[real_parts > 1e-12 * max(1.0, real_parts.max(initial=0.0))]
+    if len(real_parts) < 2:
+        return 1.0
+
+    return float(real_parts.max() / real_parts.min())
+
+
+def _probe_parameters(simulation_parameters, integrator_options, probe_fraction):
+    interval = simulation_parameters['integration']['interval']
+    probe_end = interval[0] + probe_fraction * (interval[-1] - interval[0])
+    return {
+        'integration': {**simulation_parameters['integration'], 'interval': [interval[0], probe_end], 'integrator_options': integrator_options},
+        'result': simulation_parameters['result'],
+    }
+
+
+def _cache_key(system, simulation_parameters, tolerance, external_module):
+    key = module_hash(system)
+    if isinstance(external_module, ExternalData):
+        key += f':{external_module.identity}'
+    elif getattr(external_module, '__file__', None) is not None:
+        key += f':{module_hash(external_module)}'
+
+    step_size = simulation_parameters['integration']['step_size']
+    result_step_size = simulation_parameters['result']['step_size']
+    return f'{key}:{step_size}:{result_step_size}:{tolerance}'
+
+
+def select_solver(system, simulation_parameters, tolerance, external_module=None, use_cache=True):
+    """Select the fastest solver that meets the tolerance from a short probe integration.
+
+    The stiffness ratio of the system decides which candidate solvers are probed, each candidate
+    is timed over the probe window and its error measured against a tight tolerance reference
+    solution.  The decision is cached per model hash.  Returns a dict with the 'solver' name and
+    the 'integrator_options' to use with it.
+    """
+    key = _cache_key(system, simulation_parameters, tolerance, external_module)
+    cache = load_cache(CACHE_FILE) if use_cache else {}
+    if key in cache:
+        return cache[key]
+
+    probe_fraction = simulation_parameters['result']['config'].get('probe_fraction', PROBE_FRACTION)
+    ratio = stiffness_ratio(system, simulation_parameters['integration']['interval'][0], external_module)
+    candidates = STIFF_CANDIDATES if ratio > STIFFNESS_RATIO_THRESHOLD else NON_STIFF_CANDIDATES
+
+    reference_solver, reference_options = REFERENCE_INTEGRATOR
+    reference_x, reference_y_n = solve(system, reference_solver, _probe_parameters(simulation_parameters, reference_options, probe_fraction), external_module)
+
+    timings = []
+    for solver, integrator_options in candidates:
+        probe_parameters = _probe_parameters(simulation_parameters, integrator_options, probe_fraction)
+        ts = time.perf_counter()
+        x, y_n = solve(system, solver, probe_parameters, external_module)
+        te = time.perf_counter()
+        error = solution_error(x, y_n, reference_x, reference_y_n)
+        timings.append({'solver': solver, 'integrator_options': integrator_options, 'time': te - ts, 'error': error})
+
+    acceptable = [timing for timing in timings if timing['error'] <= tolerance]
+    if acceptable:
+        selected = min(acceptable, key=lambda timing: timing['time'])
+    else:
+        selected = min(timings, key=lambda timing: timing['error'])
+
+    selection = {'solver': selected['solver'], 'integrator_options': selected['integrator_options'], 'stiffness_ratio': ratio}
+    if use_cache:
+        cache[key] = selection
+        save_cache(CACHE_FILE, cache)
+
+    return selection
@@ -0,0 +1,224 @@
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # resource is only available on Unix.
+    resource = None
+
+from cellsolver.autoselect import select_solver
+from cellsolver.external_data import data_file_hash, load_external_data, load_external_data_for, share_external_data
+from cellsolver.solvers import solve
+from cellsolver.utilities import full_path_to_file, is_valid_file, load_config, load_module_file, save_solution
+
+DEFAULT_CONFIG = {'show_plot': False, 'parameter_includes': [], 'parameter_excludes': []}
+JOB_KEYS = ['solver', 'tolerance', 'interval', 'step_size', 'result_step_size', 'config', 'ext_var', 'ext_data', 'output_file']
+
+
+def expand_module_files(patterns):
+    """Expand the given file names and glob patterns into a sorted list of model files.
+
+    Raises a ValueError for a pattern that does not match any file.
+    """
+    files = []
+    for pattern in patterns:
+        matches = sorted(path for path in glob.glob(full_path_to_file(pattern)) if is_valid_file(path))
+        if not matches:
+            raise ValueError(f"The file {pattern} does not exist!")
+
+        files.extend(matches)
+
+    return list(dict.fromkeys(files))
+
+
+def _resolve_path(path, directory):
+    return path if os.path.isabs(path) else os.path.join(directory, path)
+
+
+def load_manifest(manifest_file):
+    """Load the jobs from a job manifest JSON file.
+
+    The manifest has a list of 'models' and optional 'defaults' applied to every model, for example::
+
+     {"defaults": {"solver": "lsoda", "interval": [0.0, 500.0]},
+      "models": [{"module": "model_1.py"}, {"module": "model_2.py", "config": "model_2.json"}]}
+
+    Each model entry must set the 'module' and may set any of the keys in JOB_KEYS, the defaults
+    may set any of them except the 'output_file'.  Relative paths are resolved against the
+    directory of the manifest.  Raises a ValueError for a manifest of any other form.
+    """
+    manifest_file = full_path_to_file(manifest_file)
+    directory = os.path.dirname(manifest_file)
+    manifest = load_config(manifest_file)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('models'), list):
+        raise ValueError(f"The manifest {manifest_file} must have a list of 'models'.")
+    if not isinstance(manifest.get('defaults', {}), dict):
+        raise ValueError(f"The 'defaults' of the manifest {manifest_file} must be an object.")
+    if 'output_file' in manifest.get('defaults', {}):
+        raise ValueError(f"The 'defaults' of the manifest {manifest_file} cannot set the 'output_file', every job would write to it.")
+    for index, entry in enumerate(manifest['models']):
+        if not isinstance(entry, dict) or 'module' not in entry:
+            raise ValueError(f"Model {index} of the manifest {manifest_file} must be an object with a 'module'.")
+
+    unknown_keys = set(manifest.get('defaults', {})) - set(JOB_KEYS)
+    for entry in manifest['models']:
+        unknown_keys.update(set(entry) - {'module', *JOB_KEYS})
+    if unknown_keys:
+        raise ValueError(f"Unknown keys in the manifest {manifest_file}: {', '.join(sorted(unknown_keys))}, known keys are: module, {', '.join(JOB_KEYS)}.")
+
+    jobs = []
+    for entry in manifest['models']:
+        job = {**manifest.get('defaults', {}), **entry}
+        for pattern in expand_module_files([_resolve_path(job['module'], directory)]):
+            module_job = {**job, 'module': pattern}
+            for key in ['ext_var', 'ext_data', 'output_file']:
+                if module_job.get(key) is not None:
+                    module_job[key] = _resolve_path(module_job[key], directory)
+            if isinstance(module_job.get('config'), str):
+                module_job['config'] = load_config(_resolve_path(module_job['config'], directory))
+
+            jobs.append(module_job)
+
+    return jobs
+
+
+def job_external_module(job, system, config):
+    """Return the external variable module, or external data, given by the job, None if there is neither."""
+    if job.get('ext_data_shared') is not None or job.get('ext_data') is not None:
+        return load_external_data_for(system, config.get('external_variables', []), job.get('ext_data'), job.get('ext_data_shared'))
+    if job.get('ext_var') is not None:
+        return load_module_file(job['ext_var'])
+
+    return None
+
+
+def run_job(job):
+    """Run a single job of a batch, writing the solution to the output file of the job.
+
+    Any exception raised by the job is reported in the returned summary instead of being raised.
+    """
+    summary = {'module': job['module'], 'solver': job['solver'], 'output_file': job['output_file'], 'status': 'ok', 'time': 0.0, 'message': ''}
+    ts = time.perf_counter()
+    try:
+        system = load_module_file(job['module'])
+        config = {**DEFAULT_CONFIG, **job.get('config', {})}
+        external_module = job_external_module(job, system, config)
+        simulation_parameters = {
+            'integration': {'step_size': job['step_size'], 'interval': job['interval']},
+            'result': {'step_size': job['result_step_size'], 'config': config},
+        }
+        solver = job['solver']
+        if solver == 'auto':
+            selection = select_solver(system, simulation_parameters, job['tolerance'], external_module)
+            solver = summary['solver'] = selection['solver']
+            simulation_parameters['integration']['integrator_options'] = selection['integrator_options']
+
+        x, y_n = solve(system, solver, simulation_parameters, external_module)
+        save_solution(job['output_file'], x, y_n, system, config)
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['message'] = f'{type(e).__name__}: {e}'
+        summary['traceback'] = traceback.format_exc()
+
+    summary['time'] = time.perf_counter() - ts
+    return summary
+
+
+def _limit_memory(max_memory):
+    if resource is not None and max_memory is not None:
+        limit = int(max_memory * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_batch(jobs, workers=None, max_memory=None):
+    """Run the jobs concurrently on a process pool, returning a summary for each job.
+
+    With max_memory (in MiB) the address space of each worker process is limited, so a job that
+    exhausts it fails with a MemoryError instead of taking the machine down.  Failed jobs do not
+    abort the batch.  External data that is not memory-mapped is loaded once and shared with all
+    workers through shared memory.
+    """
+    blocks = {}
+    for job in jobs:
+        ext_data = job.get('ext_data')
+        if ext_data is not None and os.path.splitext(ext_data)[1] != '.npy':
+            if ext_data not in blocks:
+                blocks[ext_data] = share_external_data(load_external_data(ext_data), data_file_hash(ext_data))
+            job['ext_data_shared'] = blocks[ext_data][1]
+
+    try:
+        return _run_jobs(jobs, workers, max_memory)
+    finally:
+        for block, _ in blocks.values():
+            block.close()
+            block.unlink()
+
+
+def _failed_summary(job, message):
+    return {'module': job['module'], 'solver': job['solver'], 'output_file': job['output_file'], 'status': 'failed', 'time': 0.0, 'message': message}
+
+
+def _report(summary):
+    print('{0:<6} {1}'.format(summary['status'], summary['module']))
+    return summary
+
+
+def _run_isolated(job, max_memory):
+    """Run a job in a worker process of its own, so that a worker dying only fails this job."""
+    with ProcessPoolExecutor(max_workers=1, initializer=_limit_memory, initargs=(max_memory,)) as executor:
+        try:
+            return executor.submit(run_job, job).result()
+        except BrokenProcessPool:
+            return _failed_summary(job, 'The worker process running the model terminated abruptly.')
+
+
+def _run_jobs(jobs, workers, max_memory):
+    summaries = [None] * len(jobs)
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory, initargs=(max_memory,)) as executor:
+        futures = {}
+        for index, job in enumerate(jobs):
+            try:
+                futures[executor.submit(run_job, job)] = index
+            except BrokenProcessPool:
+                unfinished.append(index)
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                summaries[index] = _report(future.result())
+            except BrokenProcessPool:
+                unfinished.append(index)
+
+    # A worker died and took the pool down with it, run the jobs it left unfinished again, each
+    # in a process of its own so that only the job that kills its worker fails.
+    if unfinished:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = {executor.submit(_run_isolated, jobs[index], max_memory): index for index in sorted(unfinished)}
+            for future in as_completed(futures):
+                summaries[futures[future]] = _report(future.result())
+
+    return summaries
+
+
+def summary_table(summaries):
+    rows = [('module', 'solver', 'status', 'time (s)', 'message')]
+    rows += [(os.path.basename(s['module']), s['solver'], s['status'], f"{s['time']:.3f}", s['message']) for s in summaries]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(row, widths)) + '  ' + row[-1])
+
+    failed = sum(1 for s in summaries if s['status'] != 'ok')
+    lines.append(f'{len(summaries) - failed} succeeded, {failed} failed.')
+    return '\n'.join(lines)
+
+
+def write_summary(summary_file, summaries):
+    with open(summary_file, 'w') as f:
+        json.dump(summaries, f, indent=2)
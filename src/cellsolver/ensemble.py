@@ -0,0 +1,303 @@
+import argparse
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+
+from cellsolver.batch import job_external_module
+from cellsolver.external_data import data_file_hash, load_external_data, share_external_data
+from cellsolver.codesamples import hodgkin_huxley_squid_axon_model_1952 as hh
+from cellsolver.fit import info_index
+from cellsolver.plot import plot_ensemble
+from cellsolver.solvers import KNOWN_SOLVERS, solve, system_has_external_variables, system_solver
+from cellsolver.utilities import existing_file, load_config, load_module_file, solution_info
+
+DEFAULT_QUANTILES = [0.05, 0.5, 0.95]
+
+
+class RunningStatistics(object):
+    """Mean and variance of a stream of equally shaped arrays with Welford's algorithm."""
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+
+        return self._m2 / (self.count - 1)
+
+
+class P2Quantile(object):
+    """Streaming estimate of the p quantile of every element of equally shaped arrays.
+
+    Uses the P-square algorithm of Jain and Chlamtac, which keeps five markers for each element
+    and never stores the observations themselves.
+    """
+
+    def __init__(self, shape, p):
+        self.p = p
+        self.count = 0
+        self._initial = []
+        self._heights = np.zeros((5, *shape))
+        self._positions = np.zeros((5, *shape))
+        self._desired = np.zeros((5, *shape))
+        self._increments = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0]).reshape((5,) + (1,) * len(shape))
+
+    def add(self, value):
+        self.count += 1
+        if self.count <= 5:
+            self._initial.append(np.array(value, dtype=float))
+            if self.count == 5:
+                self._heights = np.sort(np.stack(self._initial), axis=0)
+                self._positions = np.broadcast_to(np.arange(5.0).reshape(self._increments.shape), self._heights.shape).copy()
+                self._desired = np.broadcast_to(4 * self._increments, self._heights.shape).copy()
+                self._initial = []
+            return
+
+        q = self._heights
+        n = self._positions
+        q[0] = np.minimum(q[0], value)
+        q[4] = np.maximum(q[4], value)
+        cell = (value >= q[1]).astype(int) + (value >= q[2]) + (value >= q[3])
+        for i in range(1, 5):
+            n[i] += cell < i
+        self._desired += self._increments
+
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            adjust = ((d >= 1.0) & (n[i + 1] - n[i] > 1.0)) | ((d <= -1.0) & (n[i - 1] - n[i] < -1.0))
+            if not np.any(adjust):
+                continue
+
+            s = np.sign(d)
+            parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+            neighbour_height = np.where(s > 0, q[i + 1], q[i - 1])
+            neighbour_position = np.where(s > 0, n[i + 1], n[i - 1])
+            linear = q[i] + s * (neighbour_height - q[i]) / (neighbour_position - n[i])
+            new_height = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(adjust, new_height, q[i])
+            n[i] = np.where(adjust, n[i] + s, n[i])
+
+    @property
+    def value(self):
+        if self.count < 5:
+            return np.quantile(np.stack(self._initial), self.p, axis=0) if self._initial else np.full(self._heights.shape[1:], np.nan)
+
+        return self._heights[2].copy()
+
+
+class EnsembleStatistics(object):
+    """Reduce ensemble members, arrays of outputs by time points, to per time point statistics on the fly.
+
+    The statistics take their shape from the first member added.
+    """
+
+    def __init__(self, quantiles):
+        self.running = None
+        self.quantiles = []
+        self._ps = quantiles
+
+    @property
+    def count(self):
+        return 0 if self.running is None else self.running.count
+
+    def add(self, value):
+        if self.running is None:
+            self.running = RunningStatistics(value.shape)
+            self.quantiles = [P2Quantile(value.shape, p) for p in self._ps]
+
+        self.running.add(value)
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+
+def sample_constants(system, parameters, members, seed=None):
+    """Sample the constants of the members from the parameter distributions with a scrambled Sobol sequence.
+
+    parameters maps 'component.name' to a dict with the name of a scipy.stats 'distribution' and
+    its arguments, for example {"distribution": "norm", "loc": 120.0, "scale": 10.0}.  Returns a
+    list with a dict of variable index to value for each member.
+    """
+    indices = []
+    distributions = []
+    for name, specification in parameters.items():
+        index = info_index(system.VARIABLE_INFO, name)
+        if index is None:
+            raise ValueError(f"Unknown parameter '{name}'.")
+        arguments = dict(specification)
+        distribution_name = arguments.pop('distribution', 'uniform')
+        indices.append(index)
+        distributions.append(getattr(stats, distribution_name)(**arguments))
+
+    sampler = qmc.Sobol(len(indices), scramble=True, seed=seed)
+    # Keep away from 0 and 1 where the inverse distribution of unbounded distributions is infinite.
+    uniform_samples = np.clip(sampler.random(members), 1e-12, 1 - 1e-12)
+    return [{index: float(distribution.ppf(u)) for index, distribution, u in zip(indices, distributions, sample)} for sample in uniform_samples]
+
+
+def run_member(job, constants, grid):
+    """Simulate one member with the given constants, returns its outputs interpolated onto the grid.
+
+    Returns None when the solver stopped more than one result step short of the end of the grid,
+    rather than extending its last values over the rest of the grid.
+    """
+    system = load_module_file(job['module'])
+    simulation_parameters = {
+        'integration': {'step_size': job['step_size'], 'interval': job['interval']},
+        'result': {'step_size': job['result_step_size'], 'config': job['config']},
+        'initial_values': {'variables': constants},
+    }
+    x, y_n = solve(system, job['solver'], simulation_parameters, job_external_module(job, system, job['config']))
+    if len(x) == 0 or x[-1] < grid[-1] - job['result_step_size']:
+        return None
+
+    return np.array([np.interp(grid, x, y) for y in y_n])
+
+
+def run_ensemble(job, samples, grid, statistics, workers=1):
+    """Run the members and add their outputs to the statistics as they complete, returns the number of failed members.
+
+    A member fails when its solver stops early, its outputs are not finite or it raises an
+    ArithmeticError, any other error is raised.
+
+    At most twice as many members as there are workers are in flight at any time, so memory does
+    not grow with the size of the ensemble.
+    """
+    failed = 0
+
+    def add(value):
+        nonlocal failed
+        if value is not None and np.all(np.isfinite(value)):
+            statistics.add(value)
+        else:
+            failed += 1
+
+    if workers <= 1:
+        for constants in samples:
+            try:
+                add(run_member(job, constants, grid))
+            except ArithmeticError:
+                failed += 1
+        return failed
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for constants in samples:
+            pending.add(executor.submit(run_member, job, constants, grid))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        add(future.result())
+                    except ArithmeticError:
+                        failed += 1
+        for future in wait(pending).done:
+            try:
+                add(future.result())
+            except ArithmeticError:
+                failed += 1
+
+    return failed
+
+
+def process_arguments():
+    parser = argparse.ArgumentParser(prog='cellsolver ensemble',
+                                     description='Run a Monte Carlo ensemble of a model with randomly perturbed constants.')
+    parser.add_argument('--config', required=True, type=lambda file_name: existing_file(parser, file_name),
+                        help="a JSON configuration file with an 'ensemble' section")
+    parser.add_argument('--solver', default='lsoda', choices=KNOWN_SOLVERS,
+                        help='specify the solver: {0} (default: lsoda)'.format(KNOWN_SOLVERS))
+    parser.add_argument('--interval', action='store', type=float, nargs=2, default=[0.0, 100.0],
+                        help='interval to run the simulations for (default: [0.0, 100.0])')
+    parser.add_argument('--step-size', action='store', type=float, default=0.001,
+                        help='the step size to use for integration (default: 0.001)')
+    parser.add_argument('--result-step-size', action='store', type=float, default=0.1,
+                        help='the result step size the statistics are computed at (default: 0.1)')
+    parser.add_argument('--workers', action='store', type=int, default=os.cpu_count(),
+                        help='number of worker processes running members (default: number of processors)')
+    parser.add_argument('--ext-var', default=None, type=lambda file_name: existing_file(parser, file_name),
+                        help='a module of Python code that supplies external variable functions for the module')
+    parser.add_argument('--ext-data', default=None, type=lambda file_name: existing_file(parser, file_name),
+                        help='recorded external variable traces to use instead of an external variable module')
+    parser.add_argument('--output-file', default=None,
+                        help='write the ensemble statistics to this file')
+    parser.add_argument('module', nargs='?', default=hh.__file__, type=lambda file_name: existing_file(parser, file_name),
+                        help='a module of Python code generated by libCellML')
+
+    return parser
+
+
+def main(argv=None):
+    parser = process_arguments()
+    args = parser.parse_args(argv)
+
+    config = {'show_plot': True, 'parameter_includes': [], 'parameter_excludes': []}
+    config.update(load_config(args.config))
+    ensemble_config = config.get('ensemble', {})
+    quantiles = ensemble_config.get('quantiles', DEFAULT_QUANTILES)
+
+    system = load_module_file(args.module)
+    try:
+        samples = sample_constants(system, ensemble_config.get('parameters', {}), ensemble_config.get('members', 64), ensemble_config.get('seed'))
+    except (AttributeError, TypeError, ValueError) as e:
+        parser.error(f'Invalid ensemble parameters: {e}')
+
+    job = {
+        'module': args.module, 'solver': args.solver, 'interval': args.interval, 'step_size': args.step_size,
+        'result_step_size': args.result_step_size, 'config': config, 'ext_var': args.ext_var, 'ext_data': args.ext_data,
+    }
+    points = int(round((args.interval[-1] - args.interval[0]) / args.result_step_size)) + 1
+    grid = np.linspace(args.interval[0], args.interval[-1], points)
+    statistics = EnsembleStatistics(quantiles)
+    # External data that is not memory-mapped is loaded once and shared with the worker processes.
+    block = None
+    if args.workers > 1 and args.ext_data is not None and os.path.splitext(args.ext_data)[1] != '.npy':
+        block, job['ext_data_shared'] = share_external_data(load_external_data(args.ext_data), data_file_hash(args.ext_data))
+    try:
+        # Set up errors are reported once here instead of failing every member.
+        try:
+            external_module = job_external_module(job, system, config)
+        except ValueError as e:
+            parser.error(f'{e}')
+        if external_module is None and system_has_external_variables(system):
+            parser.error('The model has external variables, give them with --ext-var or --ext-data.')
+        if args.solver == 'multirate' and not hasattr(system_solver(system), 'multirate_euler_based_solver'):
+            parser.error(f'The multirate solver is not available for {system_solver(system).__name__}.')
+
+        failed = run_ensemble(job, samples, grid, statistics, args.workers)
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+    print('{0} members, {1} failed.'.format(statistics.count, failed))
+    if statistics.count == 0:
+        return
+
+    y_n_info = solution_info(system, config)
+    result = {
+        'x': grid.tolist(), 'x_info': system.VOI_INFO, 'y_n_info': y_n_info, 'title': system.__name__,
+        'members': statistics.count, 'failed': failed,
+        'mean': statistics.running.mean, 'variance': statistics.running.variance,
+        'quantiles': {quantile.p: quantile.value for quantile in statistics.quantiles},
+    }
+    if args.output_file is not None:
+        with open(args.output_file, 'wb') as f:
+            pickle.dump(result, f)
+
+    if config['show_plot']:
+        plot_ensemble(result)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cellsolver.utilities import info_items_list, matching_info_items
+
+
+def load_external_data(data_file):
+    """Load recorded external variable traces.
+
+    The data is a two dimensional array, the first row holds the sample times and each following
+    row the trace of one external variable.  A '.npy' file is memory-mapped read-only so that the
+    trace is never copied into the process, any other file is read as comma separated text with the
+    time in the first column and one trace per following column.
+    """
+    if os.path.splitext(data_file)[1] == '.npy':
+        return np.load(data_file, mmap_mode='r')
+
+    return np.ascontiguousarray(np.loadtxt(data_file, delimiter=',', ndmin=2).T)
+
+
+def data_file_hash(data_file):
+    """Return a SHA-256 hex digest identifying the content of the external data file."""
+    digest = hashlib.sha256()
+    with open(data_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def share_external_data(data, data_hash=None):
+    """Copy the data into a new shared memory block.
+
+    Returns the shared memory block, which the caller must close and unlink once all users are
+    finished with it, and a picklable descriptor for attach_external_data.  The data_hash, see
+    data_file_hash, is passed on in the descriptor.
+    """
+    data = np.asarray(data, dtype=float)
+    block = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    shared_data = np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)
+    shared_data[:] = data
+    return block, {'name': block.name, 'shape': data.shape, 'dtype': data.dtype.str, 'data_hash': data_hash}
+
+
+def attach_external_data(descriptor):
+    """Attach to data shared with share_external_data, returns the shared memory block and a read-only view of the data."""
+    try:
+        block = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+    except TypeError:  # The track argument was added in Python 3.13.
+        block = shared_memory.SharedMemory(name=descriptor['name'])
+    data = np.ndarray(descriptor['shape'], dtype=descriptor['dtype'], buffer=block.buf)
+    data.flags.writeable = False
+    return block, data
+
+
+def external_variable_rows(system, external_variables):
+    """Map the variable index of each named external variable to its row in the external data.
+
+    The names are given as 'component.name' in the order of the rows following the time row, every
+    external variable of the system must be among them.
+    """
+    rows = {}
+    for row, item in enumerate(info_items_list(external_variables), start=1):
+        indices = [index for index, info in enumerate(system.VARIABLE_INFO) if matching_info_items(info, [item])]
+        if not indices:
+            raise ValueError(f"Unknown external variable '{item['component']}.{item['name']}'.")
+
+        rows[indices[0]] = row
+
+    missing = [f"{info['component']}.{info['name']}" for index, info in enumerate(system.VARIABLE_INFO)
+               if getattr(info['type'], 'name', None) == 'EXTERNAL' and index not in rows]
+    if missing:
+        raise ValueError(f"No external data given for the external variable(s) {', '.join(missing)}.")
+
+    return rows
+
+
+class ExternalData(object):
+    """Supply external variable functions by linearly interpolating recorded traces.
+
+    An instance is used in place of an external variable module, the traces are read in place
+    from the given data array, which may be memory-mapped or held in shared memory.  Outside of
+    the recorded times the first or last sample is used.
+
+    The identity tells apart the traces supplied, it combines the hash of the data with the rows
+    used for the external variables and is None when the data hash is not known.  The hash of a
+    data file is only computed when the identity is first asked for.
+    """
+
+    def __init__(self, data, rows, block=None, data_hash=None, data_file=None):
+        self._data = data
+        self._times = data[0]
+        self._rows = rows
+        self._block = block
+        self._data_hash = data_hash
+        self._data_file = data_file
+
+    @classmethod
+    def from_file(cls, data_file, system, external_variables):
+        return cls(load_external_data(data_file), external_variable_rows(system, external_variables), data_file=data_file)
+
+    @classmethod
+    def from_shared(cls, descriptor, system, external_variables):
+        block, data = attach_external_data(descriptor)
+        return cls(data, external_variable_rows(system, external_variables), block, descriptor.get('data_hash'))
+
+    @property
+    def identity(self):
+        if self._data_hash is None and self._data_file is not None:
+            self._data_hash = data_file_hash(self._data_file)
+
+        return None if self._data_hash is None else f'{self._data_hash}:{sorted(self._rows.items())}'
+
+    def value(self, voi, index):
+        trace = self._data[self._rows[index]]
+        i = int(np.searchsorted(self._times, voi, side='right'))
+        if i == 0:
+            return float(trace[0])
+        if i == len(trace):
+            return float(trace[-1])
+
+        t_0 = self._times[i - 1]
+        t_1 = self._times[i]
+        return float(trace[i - 1] + (trace[i] - trace[i - 1]) * (voi - t_0) / (t_1 - t_0))
+
+    def initialise_external_variable(self, index):
+        return self.value(self._times[0], index)
+
+    def update_external_variable(self, voi, states, rates, variables, index):
+        return self.value(voi, index)
+
+
+_loaded_external_data = {}
+
+
+def load_external_data_for(system, external_variables, data_file=None, descriptor=None):
+    """Return the ExternalData of the data file, or of the shared data descriptor, for the system.
+
+    Each data file or shared block is only loaded once per process for a given system and list of
+    external variables.
+    """
+    source = descriptor['name'] if descriptor is not None else data_file
+    key = (source, getattr(system, '__file__', system.__name__), tuple(external_variables))
+    if key not in _loaded_external_data:
+        if descriptor is not None:
+            _loaded_external_data[key] = ExternalData.from_shared(descriptor, system, external_variables)
+        else:
+            _loaded_external_data[key] = ExternalData.from_file(data_file, system, external_variables)
+
+    return _loaded_external_data[key]
@@ -0,0 +1,294 @@
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import differential_evolution
+
+from cellsolver.autoselect import rates_function
+from cellsolver.codesamples import hodgkin_huxley_squid_axon_model_1952 as hh
+from cellsolver.external_data import data_file_hash, load_external_data, load_external_data_for, share_external_data
+from cellsolver.solvers import KNOWN_SOLVERS, solve, system_has_external_variables
+from cellsolver.utilities import existing_file, info_items_list, load_cache, load_module_file, matching_info_items, module_hash, save_cache
+
+CACHE_FILE = 'paced_states_cache.json'
+
+
+def info_index(info, name):
+    """Return the index of the 'component.name' item in the info list, None if it is not there."""
+    item = info_items_list([name])
+    for index, entry in enumerate(info):
+        if matching_info_items(entry, item):
+            return index
+
+    return None
+
+
+class FitProblem(object):
+    """Everything needed to simulate a candidate parameter set in a worker process.
+
+    Only file names and plain data are held so that the problem can be sent to worker processes,
+    the model and external variable modules are loaded on first use in each process.  When set,
+    ext_data_shared is the descriptor of the external data in shared memory, used instead of
+    loading the external data file.
+    """
+
+    def __init__(self, module_file, solver, step_size, result_step_size, output, parameter_names, ext_var_file=None, ext_data_file=None, external_variables=None):
+        self.module_file = module_file
+        self.solver = solver
+        self.step_size = step_size
+        self.result_step_size = result_step_size
+        self.output = output
+        self.parameter_names = parameter_names
+        self.ext_var_file = ext_var_file
+        self.ext_data_file = ext_data_file
+        self.external_variables = external_variables or []
+        self.ext_data_shared = None
+
+        system = self.system()
+        self.parameter_indices = []
+        for name in parameter_names:
+            index = info_index(system.VARIABLE_INFO, name)
+            if index is None:
+                raise ValueError(f"Unknown parameter '{name}'.")
+            self.parameter_indices.append(index)
+
+        state_index = info_index(system.STATE_INFO, output)
+        if state_index is None and info_index(system.VARIABLE_INFO, output) is None:
+            raise ValueError(f"Unknown output '{output}'.")
+        if state_index is None and not system_has_external_variables(system):
+            raise ValueError(f"The output '{output}' is not a state and the solver for this model only returns states.")
+        self.output_row = state_index if state_index is not None else len(system.STATE_INFO)
+
+    def system(self):
+        return load_module_file(self.module_file)
+
+    def external_module(self):
+        if self.ext_data_file is not None:
+            return load_external_data_for(self.system(), self.external_variables, self.ext_data_file, self.ext_data_shared)
+        if self.ext_var_file is not None:
+            return load_module_file(self.ext_var_file)
+
+        return None
+
+    def simulate(self, interval, initial_states=None, constants=None):
+        """Simulate over the interval, returns x and the results with all states followed by the output."""
+        system = self.system()
+        state_names = [f"{info['component']}.{info['name']}" for info in system.STATE_INFO]
+        config = {'parameter_includes': list(dict.fromkeys([*state_names, self.output]))}
+        initial_values = {'states': dict(enumerate(initial_states)) if initial_states is not None else {}, 'variables': constants or {}}
+        simulation_parameters = {
+            'integration': {'step_size': self.step_size, 'interval': interval},
+            'result': {'step_size': self.result_step_size, 'config': config},
+            'initial_values': initial_values,
+        }
+        return solve(system, self.solver, simulation_parameters, self.external_module())
+
+
+def paced_states(problem, pacing_interval, use_cache=True):
+    """Return the states at the end of a pacing run of the model with its default constants.
+
+    The paced states are cached per model hash and simulation settings.
+    """
+    key = f'{module_hash(problem.system())}:{problem.solver}:{problem.step_size}:{pacing_interval}'
+    cache = load_cache(CACHE_FILE) if use_cache else {}
+    if key not in cache:
+        x, y_n = problem.simulate(pacing_interval)
+        cache[key] = [float(y[-1]) for y in y_n[:len(problem.system().STATE_INFO)]]
+        if use_cache:
+            save_cache(CACHE_FILE, cache)
+
+    return cache[key]
+
+
+class Objective(object):
+    """Sum of squared errors between the simulated output and the target trace.
+
+    The interval is simulated in segments, each segment continuing from the last states of the
+    previous one.  A candidate is abandoned, returning infinity, as soon as its partial error
+    exceeds the given threshold.
+    """
+
+    def __init__(self, problem, target, interval, initial_states, segments):
+        self.problem = problem
+        self.target = target
+        self.interval = interval
+        self.initial_states = initial_states
+        self.segments = segments
+
+    def __call__(self, parameters, threshold=math.inf):
+        constants = dict(zip(self.problem.parameter_indices, parameters))
+        state_count = len(self.initial_states)
+        target_times, target_values = self.target
+        boundaries = np.linspace(self.interval[0], self.interval[-1], self.segments + 1)
+
+        error = 0.0
+        start = boundaries[0]
+        states = self.initial_states
+        for index, end in enumerate(boundaries[1:]):
+            try:
+                x, y_n = self.problem.simulate([start, end], states, constants)
+            except ArithmeticError:
+                return math.inf
+
+            last_segment = index == self.segments - 1
+            in_segment = (target_times >= start) & ((target_times <= end) if last_segment else (target_times < x[-1]))
+            simulated = np.interp(target_times[in_segment], x, y_n[self.problem.output_row])
+            error += float(np.sum((simulated - target_values[in_segment]) ** 2))
+            if not math.isfinite(error):
+                return math.inf
+            if error > threshold and not last_segment:
+                return math.inf
+
+            # Continue from the last stored result so that no integration step is lost between segments.
+            start = x[-1]
+            states = [y[-1] for y in y_n[:state_count]]
+
+        return error
+
+
+class ObjectiveMap(object):
+    """Map candidates to objective values for differential_evolution, in parallel when workers > 1.
+
+    With deferred updating each generation is one map call over the trials in population order,
+    and a trial only replaces the population member at its own index when its error is no larger.
+    The errors of the population are followed here, so that each trial is abandoned as soon as it
+    is worse than the member it competes with.  Like differential_evolution the best member is moved
+    to the front after each generation.  Other calls, the initial population or polishing, are
+    evaluated in full.
+    """
+
+    def __init__(self, objective, workers):
+        self.objective = objective
+        self.executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.workers = workers
+        self.energies = None
+
+    def __call__(self, func, iterable):
+        candidates = list(iterable)
+        generation = self.energies is not None and len(candidates) == len(self.energies)
+        thresholds = list(self.energies) if generation else [math.inf] * len(candidates)
+        if self.executor is None:
+            values = list(map(self.objective, candidates, thresholds))
+        else:
+            values = list(self.executor.map(self.objective, candidates, thresholds, chunksize=max(1, len(candidates) // (4 * self.workers))))
+
+        if generation:
+            self.energies = np.minimum(self.energies, values)
+        elif self.energies is None:
+            self.energies = np.array(values, dtype=float)
+        else:
+            return values
+
+        best = int(np.argmin(self.energies))
+        self.energies[[0, best]] = self.energies[[best, 0]]
+
+        return values
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def fit(problem, target, interval, bounds, pacing_interval=None, segments=10, workers=1, max_iterations=100, seed=None, polish=False):
+    """Fit the parameters of the problem to the target trace with differential evolution."""
+    if pacing_interval is None:
+        initial_states = rates_function(problem.system(), problem.external_module())[1]
+    else:
+        initial_states = paced_states(problem, pacing_interval)
+
+    # External data that is not memory-mapped is loaded once and shared with the worker processes.
+    block = None
+    if workers > 1 and problem.ext_data_file is not None and os.path.splitext(problem.ext_data_file)[1] != '.npy':
+        block, problem.ext_data_shared = share_external_data(load_external_data(problem.ext_data_file), data_file_hash(problem.ext_data_file))
+
+    objective = Objective(problem, target, interval, initial_states, segments)
+    objective_map = ObjectiveMap(objective, workers)
+    try:
+        result = differential_evolution(objective, bounds, workers=objective_map, updating='deferred',
+                                        maxiter=max_iterations, seed=seed, polish=polish)
+    finally:
+        objective_map.shutdown()
+        if block is not None:
+            problem.ext_data_shared = None
+            block.close()
+            block.unlink()
+
+    return result
+
+
+def process_arguments():
+    parser = argparse.ArgumentParser(prog='cellsolver fit',
+                                     description='Fit constants of a model to a target trace.')
+    parser.add_argument('--target', required=True, type=lambda file_name: existing_file(parser, file_name),
+                        help="the target trace ('.npy' or comma separated text) with the time first and the values second")
+    parser.add_argument('--output', required=True,
+                        help="the 'component.name' of the state or variable to fit to the target trace")
+    parser.add_argument('--parameter', required=True, action='append', nargs=3, metavar=('NAME', 'LOWER', 'UPPER'),
+                        help="a free constant as 'component.name' and its bounds, may be given more than once")
+    parser.add_argument('--solver', default='lsoda', choices=KNOWN_SOLVERS,
+                        help='specify the solver: {0} (default: lsoda)'.format(KNOWN_SOLVERS))
+    parser.add_argument('--interval', action='store', type=float, nargs=2, default=None,
+                        help='interval to fit over (default: the times of the target trace)')
+    parser.add_argument('--pacing', action='store', type=float, nargs=2, default=None,
+                        help='interval of a pacing run of the model whose final states all candidates start from')
+    parser.add_argument('--step-size', action='store', type=float, default=0.001,
+                        help='the step size to use for integration (default: 0.001)')
+    parser.add_argument('--result-step-size', action='store', type=float, default=0.1,
+                        help='the result step size to output results at (default: 0.1)')
+    parser.add_argument('--segments', action='store', type=int, default=10,
+                        help='number of segments checked for abandoning a candidate early (default: 10)')
+    parser.add_argument('--workers', action='store', type=int, default=os.cpu_count(),
+                        help='number of worker processes evaluating candidates (default: number of processors)')
+    parser.add_argument('--max-iterations', action='store', type=int, default=100,
+                        help='maximum number of generations of differential evolution (default: 100)')
+    parser.add_argument('--seed', action='store', type=int, default=None,
+                        help='seed for the random number generator')
+    parser.add_argument('--polish', action='store_true',
+                        help='polish the best candidate with a local optimiser')
+    parser.add_argument('--config', type=lambda file_name: existing_file(parser, file_name), default=None,
+                        help="a JSON configuration file, used for its 'external_variables'")
+    parser.add_argument('--ext-var', default=None, type=lambda file_name: existing_file(parser, file_name),
+                        help='a module of Python code that supplies external variable functions for the module')
+    parser.add_argument('--ext-data', default=None, type=lambda file_name: existing_file(parser, file_name),
+                        help="recorded external variable traces to use instead of an external variable module")
+    parser.add_argument('--output-file', default=None,
+                        help='write the fitted parameters to this JSON file')
+    parser.add_argument('module', nargs='?', default=hh.__file__, type=lambda file_name: existing_file(parser, file_name),
+                        help='a module of Python code generated by libCellML')
+
+    return parser
+
+
+def main(argv=None):
+    parser = process_arguments()
+    args = parser.parse_args(argv)
+
+    external_variables = []
+    if args.config is not None:
+        with open(args.config) as f:
+            external_variables = json.load(f).get('external_variables', [])
+
+    try:
+        problem = FitProblem(args.module, args.solver, args.step_size, args.result_step_size, args.output,
+                             [name for name, _, _ in args.parameter], args.ext_var, args.ext_data, external_variables)
+    except ValueError as e:
+        parser.error(f'{e}')
+
+    target_data = load_external_data(args.target)
+    target = (np.asarray(target_data[0]), np.asarray(target_data[1]))
+    interval = args.interval if args.interval is not None else [float(target[0][0]), float(target[0][-1])]
+    bounds = [(float(lower), float(upper)) for _, lower, upper in args.parameter]
+
+    result = fit(problem, target, interval, bounds, args.pacing, args.segments, args.workers, args.max_iterations, args.seed, args.polish)
+
+    fitted = dict(zip(problem.parameter_names, (float(value) for value in result.x)))
+    for name, value in fitted.items():
+        print('{0} = {1:.6g}'.format(name, value))
+    print('sum of squared errors = {0:.6g} ({1} evaluations)'.format(result.fun, result.nfev))
+
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as f:
+            json.dump({'parameters': fitted, 'error': float(result.fun), 'evaluations': int(result.nfev), 'message': result.message}, f, indent=2)
@@ -1,60 +1,23 @@
 import argparse
-import importlib
-import json
 import os
-import pickle
+import signal
+import sys
 
 from cellsolver.codesamples import hodgkin_huxley_squid_axon_model_1952 as hh
-from cellsolver.plot import plot_solution
-from cellsolver.utilities import TimeExecution, load_config, info_items_list, not_matching_info_items, matching_info_items, apply_config
-
-SCIPY_SOLVERS = ['dopri5', 'dop853', 'vode', 'lsoda']
-KNOWN_SOLVERS = ['euler', *SCIPY_SOLVERS]
-
-
-def convert_version_to_module_name(version):
-    modified_version = version.replace('.', '_')
-    return f'version_{modified_version}'
-
-
-def system_is_reset_capable(system):
-    if hasattr(system, 'create_resets_array') and hasattr(system, 'compute_reset_test_value_differences') and hasattr(system, 'apply_resets'):
-        return True
-
-    return False
-
-
-def system_has_external_variables(system):
-    if hasattr(system, 'initialise_states_and_constants') and hasattr(system, 'compute_rates') and hasattr(system, 'compute_variables'):
-        def dummy_initial_function(index):
-            return 0.0
-
-        def dummy_function(voi, states, rates, variables, index):
-            return 1.0
-
-        try:
-            system.initialise_states_and_constants(None, None, dummy_initial_function)
-            system.compute_rates(None, None, None, None, dummy_function)
-            system.compute_variables(None, None, None, None, dummy_function)
-        except TypeError as e:
-            if f'{e}' == "'NoneType' object does not support item assignment":
-                return True
-
-        return False
-
-    return False
-
-
-def system_solver(system):
-    generation_version = convert_version_to_module_name(system.__version__)
-    module_name = f'cellsolver.solvers.{generation_version}'
-    if system_is_reset_capable(system):
-        module_name += '_reset_capable'
-    if system_has_external_variables(system):
-        module_name += '_external_variables'
-
-    i = importlib.import_module(module_name)
-    return i
+from cellsolver import batch, ensemble, fit, work_precision
+from cellsolver.autoselect import select_solver
+from cellsolver.external_data import ExternalData
+from cellsolver.pipeline import ChunkWriter, ResultPipeline
+from cellsolver.plot import LivePlot, plot_solution
+from cellsolver.progress import ProgressBar, ProgressMonitor, TelemetryLog
+from cellsolver.solvers import SCIPY_SOLVERS, KNOWN_SOLVERS, solve, system_solver
+from cellsolver.utilities import TimeExecution, existing_file, load_config, possible_json_file, valid_module, save_solution, solution_info
+
+COMMANDS = {
+    'ensemble': ensemble.main,
+    'fit': fit.main,
+    'work-precision': work_precision.main,
+}
 
 
 @TimeExecution
@@ -63,64 +26,23 @@ def solve_using_euler(system, simulation_parameters, external_module=None):
     return solver_module.euler_based_solver(system, simulation_parameters, external_module)
 
 
+@TimeExecution
+def solve_using_multirate(system, simulation_parameters, external_module=None):
+    return solve(system, 'multirate', simulation_parameters, external_module)
+
+
 @TimeExecution
 def solve_using_scipy(system, solver_method, simulation_parameters, external_module=None):
     solver_module = system_solver(system)
     return solver_module.scipy_based_solver(system, solver_method, simulation_parameters, external_module)
 
 
-def module_from_file(module_name, file_path):
-    spec = importlib.util.spec_from_file_location(module_name, file_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
-
-
-def full_path_to_file(arg):
-    expanded_path = os.path.expanduser(arg)
-    expanded_path = os.path.expandvars(expanded_path)
-    return os.path.abspath(expanded_path)
-
-
-def is_valid_file(arg):
-    full_path = full_path_to_file(arg)
-    if os.path.exists(full_path) and os.path.isfile(full_path):
-        return True
-
-    return False
-
-
-def possible_json_file(parser, arg):
-    if is_valid_file(arg):
-        full_path = full_path_to_file(arg)
-        try:
-            with open(full_path) as f:
-                content = f.read()
-
-            json.loads(content)
-            return full_path
-        except json.JSONDecodeError:
-            parser.error(f"The config file {arg} is not valid JSON!")
-    elif arg is None:
-        return ''
-
-    parser.error(f"The config file {arg} does not exist!")
-
-
-def valid_module(parser, arg):
-    if is_valid_file(arg):
-        full_path = full_path_to_file(arg)
-        module_name = os.path.splitext(os.path.basename(full_path))[0]
-        loaded_module = module_from_file(module_name, full_path)
-        return loaded_module  # return the actual loaded module
-    else:
-        parser.error("The file %s does not exist!" % arg)
-
-
 def process_arguments():
     parser = argparse.ArgumentParser(description="Solve ODE's described by libCellML generated Python output.")
     parser.add_argument('--solver', default=KNOWN_SOLVERS[0],
-                        help='specify the solver: {0} (default: {1})'.format(KNOWN_SOLVERS, KNOWN_SOLVERS[0]))
+                        help='specify the solver: {0}, or "auto" to select one with a probe integration (default: {1})'.format(KNOWN_SOLVERS, KNOWN_SOLVERS[0]))
+    parser.add_argument('--tolerance', action='store', type=float, default=1e-3,
+                        help='the error tolerance the "auto" solver selection must meet (default: 0.001)')
     parser.add_argument('--timeit', action='store', type=int, nargs='?', const=10, default=0,
                         help='number of iterations for evaluating execution elapsed time (default: 0)')
     parser.add_argument('--interval', action='store', type=float, nargs=2, default=[0.0, 100.0],
@@ -133,15 +55,63 @@ def process_arguments():
                         help='a JSON configuration file')
     parser.add_argument('--output-file', default=None,
                         help='specify an output file')
+    parser.add_argument('--progress', action='store_true',
+                        help='show a progress bar while solving, press Ctrl-C to stop the solver and keep the results so far')
+    parser.add_argument('--telemetry', default=None,
+                        help='append progress reports as JSON lines to this file')
+    parser.add_argument('--stream-output', action='store_true',
+                        help='write the output file compressed on a background thread while solving, '
+                             'without a plot the results are not kept in memory')
+    parser.add_argument('--live-plot', action='store_true',
+                        help='plot the solution while solving')
     parser.add_argument('--ext-var', nargs='?', default=None, type=lambda file_name: valid_module(parser, file_name),
                         help='a module of Python code that supplies external variable functions for the module')
-    parser.add_argument('module', nargs='?', default=hh, type=lambda file_name: valid_module(parser, file_name),
-                        help='a module of Python code generated by libCellML')
+    parser.add_argument('--ext-data', type=lambda file_name: existing_file(parser, file_name), default=None,
+                        help="recorded external variable traces ('.npy' or comma separated text) to use instead of an external variable module")
+    parser.add_argument('--manifest', type=lambda file_name: possible_json_file(parser, file_name), default=None,
+                        help='a JSON job manifest of models to run as a batch')
+    parser.add_argument('--jobs', action='store', type=int, default=None,
+                        help='number of worker processes for batch runs (default: number of processors)')
+    parser.add_argument('--max-memory', action='store', type=float, default=None,
+                        help='maximum memory in MiB for each worker process of a batch run')
+    parser.add_argument('--output-dir', default='.',
+                        help='directory to write batch run solutions and summary to (default: current directory)')
+    parser.add_argument('module', nargs='*', default=[],
+                        help='modules of Python code generated by libCellML, or glob patterns matching them; '
+                             'more than one module is run as a batch')
 
     return parser
 
 
+def run_batch(args, module_files, manifest_jobs, config):
+    defaults = {
+        'solver': args.solver, 'tolerance': args.tolerance, 'interval': args.interval, 'step_size': args.step_size,
+        'result_step_size': args.result_step_size, 'config': config,
+        'ext_var': args.ext_var.__file__ if args.ext_var is not None else None, 'ext_data': args.ext_data,
+    }
+    jobs = [{'module': module_file} for module_file in module_files] + manifest_jobs
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_names = []
+    for index, job in enumerate(jobs):
+        for key, value in defaults.items():
+            job.setdefault(key, value)
+        if job.get('output_file') is None:
+            output_name = os.path.splitext(os.path.basename(job['module']))[0]
+            if output_name in output_names:
+                output_name += f'_{index}'
+            output_names.append(output_name)
+            job['output_file'] = os.path.join(args.output_dir, f'{output_name}.pickle')
+
+    summaries = batch.run_batch(jobs, args.jobs, args.max_memory)
+    batch.write_summary(os.path.join(args.output_dir, 'summary.json'), summaries)
+    print(batch.summary_table(summaries))
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     parser = process_arguments()
     args = parser.parse_args()
 
@@ -153,20 +123,90 @@ def main():
     TimeExecution.run_timeit = args.timeit > 0
     if TimeExecution.run_timeit:
         TimeExecution.number = args.timeit
+        # The timed runs repeat the solve, progress reports and cancellation only make sense for a single run.
+        if args.progress or args.telemetry is not None:
+            parser.error('--timeit cannot be combined with --progress or --telemetry')
+        if args.stream_output or args.live_plot:
+            parser.error('--timeit cannot be combined with --stream-output or --live-plot')
+
+    if args.stream_output and args.output_file is None:
+        parser.error('--stream-output requires --output-file')
 
     external_module = None
     if args.ext_var is not None:
         external_module = args.ext_var
 
+    try:
+        module_files = batch.expand_module_files(args.module)
+    except ValueError as e:
+        parser.error(f'{e}')
+
+    if args.manifest is not None or len(module_files) > 1:
+        manifest_jobs = []
+        if args.manifest is not None:
+            try:
+                manifest_jobs = batch.load_manifest(args.manifest)
+            except ValueError as e:
+                parser.error(f'{e}')
+
+        return run_batch(args, module_files, manifest_jobs, config)
+
+    module = hh if not module_files else valid_module(parser, module_files[0])
+    if args.ext_data is not None:
+        try:
+            external_module = ExternalData.from_file(args.ext_data, module, config.get('external_variables', []))
+        except ValueError as e:
+            parser.error(f'{e}')
+
     valid_solution = True
     simulation_parameters = {
         'integration': {'step_size': args.step_size, 'interval': args.interval},
         'result': {'step_size': args.result_step_size, 'config': config},
     }
+    if args.solver == "auto":
+        selection = select_solver(module, simulation_parameters, args.tolerance, external_module)
+        print("Selected solver '{0}' (stiffness ratio {1:.3g}).".format(selection['solver'], selection['stiffness_ratio']))
+        args.solver = selection['solver']
+        simulation_parameters['integration']['integrator_options'] = selection['integrator_options']
+
+    callbacks = []
+    if args.progress:
+        callbacks.append(ProgressBar())
+    if args.telemetry is not None:
+        callbacks.append(TelemetryLog(args.telemetry))
+    consumers = []
+    if args.stream_output:
+        consumers.append(ChunkWriter(args.output_file, {'x_info': module.VOI_INFO, 'y_n_info': solution_info(module, config), 'title': module.__name__}))
+    if args.live_plot:
+        live_plot = LivePlot(module.VOI_INFO, solution_info(module, config), module.__name__)
+        consumers.append(live_plot.add_chunk)
+        callbacks.append(live_plot)
+    pipeline = None
+    if consumers:
+        # Results are only dropped when nothing reads them after the solve.
+        pipeline = ResultPipeline(consumers, retain=config['show_plot'] or (args.output_file is not None and not args.stream_output))
+        simulation_parameters['pipeline'] = pipeline
+
+    # The monitor is only attached when its reports are used, it costs the solvers a call every step.
+    monitor = None
+    if callbacks:
+        monitor = ProgressMonitor(args.interval, callbacks, every_seconds=0.2 if args.live_plot else 1.0)
+        simulation_parameters['monitor'] = monitor
+        # Stop the solver cleanly on Ctrl-C, keeping the results gathered so far.
+        default_handler = signal.signal(signal.SIGINT, lambda signum, frame: monitor.cancellation_token.cancel())
+
     if args.solver == "euler":
-        [x, y_n] = solve_using_euler(args.module, simulation_parameters, external_module)
+        [x, y_n] = solve_using_euler(module, simulation_parameters, external_module)
+    elif args.solver == "multirate":
+        try:
+            [x, y_n] = solve_using_multirate(module, simulation_parameters, external_module)
+        except ValueError as e:
+            x = []
+            y_n = []
+            valid_solution = False
+            print(e)
     elif args.solver in SCIPY_SOLVERS:
-        [x, y_n] = solve_using_scipy(args.module, args.solver, simulation_parameters, external_module)
+        [x, y_n] = solve_using_scipy(module, args.solver, simulation_parameters, external_module)
     else:
         x = []
         y_n = []
@@ -174,19 +214,22 @@ def main():
         print("Unknown solver '{0}'.".format(args.solver))
         parser.print_help()
 
-    if valid_solution:
-        plot_title = args.module.__name__
+    if monitor is not None:
+        signal.signal(signal.SIGINT, default_handler)
+    if pipeline is not None:
+        pipeline.close(x, y_n)
 
-        parameter_info = [*args.module.STATE_INFO, *args.module.VARIABLE_INFO]
-        indices = apply_config(config, parameter_info)
-        y_n_info = [parameter_info[i] for i in indices]
+    if valid_solution:
+        if monitor is not None:
+            monitor.finish()
+            if monitor.cancelled:
+                print("Simulation cancelled at {0} = {1}, keeping the partial results.".format(module.VOI_INFO['name'], monitor.t))
 
         if config['show_plot']:
-            plot_solution(x, y_n, args.module.VOI_INFO, y_n_info, plot_title)
+            plot_solution(x, y_n, module.VOI_INFO, solution_info(module, config), module.__name__)
 
-        if args.output_file is not None:
-            with open(args.output_file, 'wb') as f:
-                pickle.dump({'x': x, 'x_info': args.module.VOI_INFO, 'y_n': y_n, 'y_n_info': y_n_info, 'title': plot_title}, f)
+        if args.output_file is not None and not args.stream_output:
+            save_solution(args.output_file, x, y_n, module, config)
 
 
 if __name__ == "__main__":
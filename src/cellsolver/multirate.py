@@ -0,0 +1,123 @@
+import ast
+import inspect
+import textwrap
+
+from cellsolver.utilities import info_items_list, matching_info_items
+
+DEFAULT_RATIO = 10
+DEFAULT_SEPARATION = 10.0
+
+_ARRAYS = ('rates', 'variables')
+
+
+def _element(node):
+    """Return (array, index) for a node like variables[3], None otherwise."""
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id in _ARRAYS:
+        index = node.slice
+        if isinstance(index, ast.Constant) and isinstance(index.value, int):
+            return node.value.id, index.value
+
+    return None
+
+
+def _reads(node):
+    """Return the array elements read by the expression and the arrays read as a whole."""
+    elements = set()
+    whole_arrays = set()
+    element_nodes = set()
+    for child in ast.walk(node):
+        element = _element(child)
+        if element is not None:
+            elements.add(element)
+            element_nodes.add(id(child.value))
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id in _ARRAYS and id(child) not in element_nodes:
+            whole_arrays.add(child.id)
+
+    return elements, whole_arrays
+
+
+def slice_compute_rates(compute_rates, rate_indices):
+    """Create a compute_rates function that only computes the given rates.
+
+    The generated compute_rates is a sequence of assignments to rates and variables elements, the
+    new function keeps only the assignments the given rates depend on.  Returns None when the
+    function is not of that form.
+    """
+    try:
+        source = textwrap.dedent(inspect.getsource(compute_rates))
+    except (OSError, TypeError):
+        return None
+
+    function_definition = ast.parse(source).body[0]
+    if not isinstance(function_definition, ast.FunctionDef):
+        return None
+
+    statements = []
+    for statement in function_definition.body:
+        if isinstance(statement, ast.Pass):
+            continue
+        if not (isinstance(statement, ast.Assign) and len(statement.targets) == 1 and _element(statement.targets[0]) is not None):
+            return None
+        statements.append((statement, _element(statement.targets[0]), *_reads(statement.value)))
+
+    needed = {('rates', index) for index in rate_indices}
+    needed_arrays = set()
+    kept = []
+    for statement, target, elements, whole_arrays in reversed(statements):
+        if target in needed or target[0] in needed_arrays:
+            kept.append(statement)
+            needed.discard(target)
+            needed.update(elements)
+            needed_arrays.update(whole_arrays)
+
+    function_definition.body = list(reversed(kept)) or [ast.Pass()]
+    function_definition.decorator_list = []
+    module = ast.fix_missing_locations(ast.Module(body=[function_definition], type_ignores=[]))
+    namespace = dict(compute_rates.__globals__)
+    exec(compile(module, inspect.getsourcefile(compute_rates) or '<multirate>', 'exec'), namespace)
+    return namespace[function_definition.name]
+
+
+def partition_states(system, config, rates_at, states):
+    """Split the state indices into fast and slow partitions.
+
+    The fast states are named by 'fast' in the 'multirate' config as 'component.name', otherwise
+    they are found from the diagonal of the Jacobian at the given states: a state is fast when its
+    |df_i/dy_i| is within a factor 'separation' of the largest one.  rates_at(states) must return
+    the rates for the given states.
+    """
+    multirate_config = config.get('multirate', {})
+    if 'fast' in multirate_config:
+        fast_items = info_items_list(multirate_config['fast'])
+        fast = [index for index, info in enumerate(system.STATE_INFO) if matching_info_items(info, fast_items)]
+    else:
+        separation = multirate_config.get('separation', DEFAULT_SEPARATION)
+        rates_0 = list(rates_at(list(states)))
+        diagonal = []
+        for index, value in enumerate(states):
+            h = 1e-7 * max(1.0, abs(value))
+            perturbed_states = list(states)
+            perturbed_states[index] = value + h
+            diagonal.append(abs((rates_at(perturbed_states)[index] - rates_0[index]) / h))
+        threshold = max(diagonal, default=0.0) / separation
+        fast = [index for index, value in enumerate(diagonal) if value >= threshold and value > 0.0]
+
+    slow = [index for index in range(len(states)) if index not in fast]
+    return fast, slow
+
+
+def partitioned_rates_functions(system, fast, slow):
+    """Return the compute_rates functions for the fast and the slow states, falling back to the full compute_rates.
+
+    A wrapper around the system, like the work-precision CountingSystem, may give the original
+    compute_rates as __wrapped__ and a wrap_rates_function method that is applied to both functions.
+    """
+    compute_rates = inspect.unwrap(system.compute_rates)
+    compute_fast_rates = slice_compute_rates(compute_rates, fast) or compute_rates
+    compute_slow_rates = slice_compute_rates(compute_rates, slow) or compute_rates
+    wrap_rates_function = getattr(system, 'wrap_rates_function', None)
+    if wrap_rates_function is not None:
+        return wrap_rates_function(compute_fast_rates), wrap_rates_function(compute_slow_rates)
+
+    return compute_fast_rates, compute_slow_rates
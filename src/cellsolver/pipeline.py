@@ -0,0 +1,87 @@
+import gzip
+import pickle
+import queue
+import threading
+
+STREAM_FORMAT = 'cellsolver-stream'
+
+_END = object()
+
+
+class ChunkWriter(object):
+    """Write a solution as a gzip compressed stream of pickles, a header followed by the result chunks."""
+
+    def __init__(self, output_file, header):
+        self._file = gzip.open(output_file, 'wb', compresslevel=6)
+        pickle.dump({**header, 'format': STREAM_FORMAT}, self._file)
+
+    def __call__(self, chunk):
+        pickle.dump(chunk, self._file)
+
+    def close(self):
+        self._file.close()
+
+
+class ResultPipeline(object):
+    """Hand result chunks from a solver to consumers running on a background thread.
+
+    Solvers call push after storing a result, once chunk_size new results have been stored they are
+    copied into a chunk and put on a queue that holds at most max_chunks chunks.  When the consumers
+    fall behind push blocks, so the memory used by the pipeline stays bounded.  Unless retain is
+    True the results handed on are removed from the solver's lists, keeping the memory used by the
+    solver bounded too.  Each consumer is called with every chunk, a dict of 'x' and 'y_n'.
+    """
+
+    def __init__(self, consumers, chunk_size=1000, max_chunks=8, retain=True):
+        self.consumers = consumers
+        self.chunk_size = chunk_size
+        self.retain = retain
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._emitted = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._consume, name='cellsolver-pipeline', daemon=True)
+        self._thread.start()
+
+    def push(self, x, results):
+        if len(x) - self._emitted >= self.chunk_size:
+            self._emit(x, results)
+
+    def close(self, x, results):
+        """Hand on the remaining results and wait for the consumers to finish with every chunk."""
+        if len(x) > self._emitted:
+            self._emit(x, results)
+        self._queue.put(_END)
+        self._thread.join()
+        for consumer in self.consumers:
+            if hasattr(consumer, 'close'):
+                consumer.close()
+
+        if self._error is not None:
+            raise self._error
+
+    def _emit(self, x, results):
+        if self._error is not None:
+            raise self._error
+
+        chunk = {'x': x[self._emitted:], 'y_n': [result[self._emitted:] for result in results]}
+        self._queue.put(chunk)
+        if self.retain:
+            self._emitted = len(x)
+        else:
+            del x[:]
+            for result in results:
+                del result[:]
+
+    def _consume(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is _END:
+                break
+            if self._error is not None:
+                continue
+
+            try:
+                for consumer in self.consumers:
+                    consumer(chunk)
+            except Exception as e:
+                self._error = e
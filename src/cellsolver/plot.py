@@ -1,9 +1,11 @@
 import math
+import threading
+
 import matplotlib.pyplot as graph
-from matplotlib import cm
 
 
 def plot_solution(x, y_n, x_info, y_n_info, title):
+    graph.figure()
     extents = _get_extents(y_n, y_n_info)
     unique_extents = list(set(extents))
     ordered_unique_extents = sorted(unique_extents)
@@ -39,9 +41,95 @@ def plot_sensitivity(x, y_n, x_info, y_info, title):
     graph.show()
 
 
+class LivePlot(object):
+    """Plot a solution while it is being solved.
+
+    The plot is fed result chunks from the result pipeline thread and is redrawn when called as a
+    progress callback, which happens on the thread running the solver, as matplotlib can only be
+    used from a single thread.  At most about max_points points are kept for each result.  The plot
+    is drawn in a figure of its own, created on the first draw.
+    """
+
+    def __init__(self, x_info, y_n_info, title, max_points=5000):
+        self.x_info = x_info
+        self.y_n_info = y_n_info
+        self.title = title
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._stride = 1
+        self._offset = 0
+        self._x = []
+        self._y_n = []
+        self._axes = None
+        self._lines = None
+
+    def add_chunk(self, chunk):
+        with self._lock:
+            if not self._y_n:
+                self._y_n = [[] for _ in chunk['y_n']]
+            start = (-self._offset) % self._stride
+            self._offset += len(chunk['x'])
+            self._x.extend(chunk['x'][start::self._stride])
+            for y, chunk_y in zip(self._y_n, chunk['y_n']):
+                y.extend(chunk_y[start::self._stride])
+            if len(self._x) > self.max_points:
+                self._stride *= 2
+                self._x = self._x[::2]
+                self._y_n = [y[::2] for y in self._y_n]
+
+    def __call__(self, report):
+        with self._lock:
+            x = list(self._x)
+            y_n = [list(y) for y in self._y_n]
+
+        if not x:
+            return
+
+        if self._lines is None:
+            self._axes = graph.figure().add_subplot()
+            colours = _get_colours(len(y_n))
+            self._lines = []
+            for index in range(len(y_n)):
+                info = self.y_n_info[index] if index < len(self.y_n_info) else {'component': '', 'name': f'{index}'}
+                line, = self._axes.plot(x, y_n[index], label=r"{0}.{1}".format(info['component'], info['name']), color=colours[index])
+                self._lines.append(line)
+            self._axes.set_xlabel("{0} ({1})".format(self.x_info['name'], self.x_info['units']))
+            self._axes.set_title(self.title)
+            self._axes.legend()
+        else:
+            for line, y in zip(self._lines, y_n):
+                line.set_data(x, y)
+
+        self._axes.relim()
+        self._axes.autoscale_view()
+        graph.pause(0.001)
+
+
+def plot_ensemble(result):
+    y_n_info = result['y_n_info']
+    mean = result['mean']
+    quantiles = sorted(result['quantiles'])
+    colours = _get_colours(len(mean))
+    for index, y_mean in enumerate(mean):
+        graph.subplot(len(mean), 1, index + 1)
+        info = y_n_info[index] if index < len(y_n_info) else {'component': '', 'name': f'{index}', 'units': ''}
+        label = r"{0}.{1}".format(info['component'], info['name'])
+        graph.plot(result['x'], y_mean, label=f'{label} mean', color=colours[index])
+        if len(quantiles) > 1:
+            graph.fill_between(result['x'], result['quantiles'][quantiles[0]][index], result['quantiles'][quantiles[-1]][index],
+                               color=colours[index], alpha=0.3, label=f'{label} {quantiles[0]}-{quantiles[-1]} quantiles')
+        graph.ylabel("{0}".format(info['units']))
+        graph.legend()
+        if index == 0:
+            graph.title(f"{result['title']} ({result['members']} members)")
+
+    graph.xlabel("{0} ({1})".format(result['x_info']['name'], result['x_info']['units']))
+    graph.show()
+
+
 def _get_colours(num_colours):
     colours = []
-    colour_map = cm.get_cmap('hsv')
+    colour_map = graph.get_cmap('hsv')
     for i in range(num_colours):
         colour = colour_map(1. * i / num_colours)  # color will now be an RGBA tuple
         colours.append(colour)
@@ -61,3 +149,27 @@ def _get_extents(data_in, data_info):
                                             data_info[index]['units']))
 
     return extents
+
+
+def plot_work_precision(measurements, plot_file=None):
+    figure, axes = graph.subplots(len(measurements), 2, squeeze=False, figsize=(10, 4 * len(measurements)))
+    for row, (title, runs) in enumerate(measurements.items()):
+        solvers = list(dict.fromkeys(run['solver'] for run in runs))
+        for solver in solvers:
+            solver_runs = [run for run in runs if run['solver'] == solver and math.isfinite(run['error']) and run['error'] > 0.0]
+            errors = [run['error'] for run in solver_runs]
+            axes[row][0].loglog([run['rhs_evaluations'] for run in solver_runs], errors, marker='o', label=solver)
+            axes[row][1].loglog([run['time'] for run in solver_runs], errors, marker='o', label=solver)
+
+        axes[row][0].set_title(title)
+        axes[row][0].set_xlabel('RHS evaluations')
+        axes[row][1].set_xlabel('wall time (s)')
+        for axis in axes[row]:
+            axis.set_ylabel('error')
+            axis.legend()
+
+    figure.tight_layout()
+    if plot_file is None:
+        graph.show()
+    else:
+        figure.savefig(plot_file)
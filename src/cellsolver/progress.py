@@ -0,0 +1,111 @@
+import json
+import sys
+import threading
+import time
+
+
+class CancellationToken(object):
+    """A thread safe flag used to ask a running solver to stop."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class ProgressMonitor(object):
+    """Track the progress of a solver and report it to callbacks.
+
+    Solvers call update with the current value of the variable of integration after every step,
+    callbacks are called with a report dict every `every_steps` steps or `every_seconds` seconds,
+    whichever comes first.  update returns True when the cancellation token has been cancelled,
+    the solver then stops and returns the results gathered so far.  The clock and the cancellation
+    token are only checked every `check_steps` steps to keep the cost of update low.
+    """
+
+    def __init__(self, interval, callbacks=None, cancellation_token=None, every_steps=10000, every_seconds=1.0, check_steps=100):
+        self.start = interval[0]
+        self.end = interval[-1]
+        self.callbacks = callbacks if callbacks is not None else []
+        self.cancellation_token = cancellation_token if cancellation_token is not None else CancellationToken()
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.check_steps = check_steps
+        self.reset()
+
+    def reset(self):
+        self.t = self.start
+        self.steps = 0
+        self.cancelled = False
+        self._start_time = time.perf_counter()
+        self._next_check = self.check_steps
+        self._last_report_steps = 0
+        self._last_report_time = self._start_time
+
+    def update(self, t):
+        self.t = t
+        self.steps += 1
+        if self.steps < self._next_check:
+            return False
+
+        self._next_check = self.steps + self.check_steps
+        now = time.perf_counter()
+        if self.steps - self._last_report_steps >= self.every_steps or now - self._last_report_time >= self.every_seconds:
+            self._last_report_steps = self.steps
+            self._last_report_time = now
+            self._report('running', now)
+
+        self.cancelled = self.cancellation_token.cancelled
+        return self.cancelled
+
+    def finish(self):
+        self._report('cancelled' if self.cancelled else 'finished', time.perf_counter())
+
+    def _report(self, status, now):
+        elapsed = now - self._start_time
+        span = self.end - self.start
+        fraction = min(1.0, max(0.0, (self.t - self.start) / span)) if span > 0.0 else 1.0
+        report = {
+            'status': status,
+            't': self.t,
+            'fraction': fraction,
+            'steps': self.steps,
+            'elapsed': elapsed,
+            'steps_per_second': self.steps / elapsed if elapsed > 0.0 else 0.0,
+            'eta': elapsed * (1.0 - fraction) / fraction if fraction > 0.0 else None,
+        }
+        for callback in self.callbacks:
+            callback(report)
+
+
+class ProgressBar(object):
+    """Progress callback drawing a single line progress bar."""
+
+    def __init__(self, stream=None, width=40):
+        self.stream = stream if stream is not None else sys.stderr
+        self.width = width
+
+    def __call__(self, report):
+        filled = int(self.width * report['fraction'])
+        eta = '--' if report['eta'] is None else f"{report['eta']:.1f} s"
+        self.stream.write(f"\r[{'#' * filled}{'.' * (self.width - filled)}] {100 * report['fraction']:5.1f}%"
+                          f"  t = {report['t']:.6g}  {report['steps_per_second']:.0f} steps/s  ETA {eta}  ")
+        if report['status'] != 'running':
+            self.stream.write(f"{report['status']}\n")
+        self.stream.flush()
+
+
+class TelemetryLog(object):
+    """Progress callback appending each report as a line of JSON to a file."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __call__(self, report):
+        with open(self.file_name, 'a') as f:
+            f.write(json.dumps(report) + '\n')
@@ -0,0 +1,65 @@
+import importlib
+
+SCIPY_SOLVERS = ['dopri5', 'dop853', 'vode', 'lsoda']
+KNOWN_SOLVERS = ['euler', 'multirate', *SCIPY_SOLVERS]
+
+
+def convert_version_to_module_name(version):
+    modified_version = version.replace('.', '_')
+    return f'version_{modified_version}'
+
+
+def system_is_reset_capable(system):
+    if hasattr(system, 'create_resets_array') and hasattr(system, 'compute_reset_test_value_differences') and hasattr(system, 'apply_resets'):
+        return True
+
+    return False
+
+
+def system_has_external_variables(system):
+    if hasattr(system, 'initialise_states_and_constants') and hasattr(system, 'compute_rates') and hasattr(system, 'compute_variables'):
+        def dummy_initial_function(index):
+            return 0.0
+
+        def dummy_function(voi, states, rates, variables, index):
+            return 1.0
+
+        try:
+            system.initialise_states_and_constants(None, None, dummy_initial_function)
+            system.compute_rates(None, None, None, None, dummy_function)
+            system.compute_variables(None, None, None, None, dummy_function)
+        except TypeError as e:
+            if f'{e}' == "'NoneType' object does not support item assignment":
+                return True
+
+        return False
+
+    return False
+
+
+def system_solver(system):
+    generation_version = convert_version_to_module_name(system.__version__)
+    module_name = f'cellsolver.solvers.{generation_version}'
+    if system_is_reset_capable(system):
+        module_name += '_reset_capable'
+    if system_has_external_variables(system):
+        module_name += '_external_variables'
+
+    i = importlib.import_module(module_name)
+    return i
+
+
+def solve(system, solver, simulation_parameters, external_module=None, solver_module=None):
+    if solver_module is None:
+        solver_module = system_solver(system)
+
+    if solver == 'euler':
+        return solver_module.euler_based_solver(system, simulation_parameters, external_module)
+    elif solver == 'multirate':
+        if not hasattr(solver_module, 'multirate_euler_based_solver'):
+            raise ValueError(f"The multirate solver is not available for {solver_module.__name__}.")
+        return solver_module.multirate_euler_based_solver(system, simulation_parameters, external_module)
+    elif solver in SCIPY_SOLVERS:
+        return solver_module.scipy_based_solver(system, solver, simulation_parameters, external_module)
+
+    raise ValueError(f"Unknown solver '{solver}'.")
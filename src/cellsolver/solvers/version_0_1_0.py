@@ -1,13 +1,17 @@
 
 from scipy.integrate import ode
 
+from cellsolver.multirate import DEFAULT_RATIO, partition_states, partitioned_rates_functions
+from cellsolver.utilities import override_initial_values
 
-def initialize_system(system):
+
+def initialize_system(system, initial_values=None):
     rates = system.create_states_array()
     states = system.create_states_array()
     variables = system.create_variables_array()
 
     system.initialize_states_and_constants(states, variables)
+    override_initial_values(states, variables, initial_values)
     system.compute_computed_constants(variables)
 
     return states, rates, variables
@@ -19,10 +23,12 @@ def update(voi, states, system, rates, variables):
 
 
 def euler_based_solver(system, simulation_parameters, external_module):
-    states, rates, variables = initialize_system(system)
+    states, rates, variables = initialize_system(system, simulation_parameters.get('initial_values'))
 
     step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(step_size, list):
         step_size = step_size[0]
@@ -38,6 +44,9 @@ def euler_based_solver(system, simulation_parameters, external_module):
         for index, value in enumerate(states):
             results[index].append(value)
 
+        if pipeline is not None:
+            pipeline.push(x, results)
+
         system.compute_rates(t, states, rates, variables)
 
         delta = list(map(lambda var: var * step_size, rates))
@@ -45,14 +54,81 @@ def euler_based_solver(system, simulation_parameters, external_module):
 
         t += step_size
 
+        if monitor is not None and monitor.update(t):
+            break
+
+    return x, results
+
+
+def multirate_euler_based_solver(system, simulation_parameters, external_module):
+    """Forward Euler with the fast states sub-stepped at the step size and the slow states stepped 'ratio' times coarser.
+
+    The slow rates are only computed once per coarse step, the slow states follow them linearly
+    during the fast sub-steps.
+    """
+    states, rates, variables = initialize_system(system, simulation_parameters.get('initial_values'))
+
+    step_size = simulation_parameters['integration']['step_size']
+    interval = simulation_parameters['integration']['interval']
+    config = simulation_parameters['result'].get('config', {})
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
+
+    if isinstance(step_size, list):
+        step_size = step_size[0]
+
+    ratio = config.get('multirate', {}).get('ratio', DEFAULT_RATIO)
+
+    fast, slow = partition_states(system, config, lambda y: update(interval[0], y, system, rates, variables)[:], states)
+    compute_fast_rates, compute_slow_rates = partitioned_rates_functions(system, fast, slow)
+
+    results = [[] for _ in range(len(states))]
+    x = []
+
+    t = interval[0]
+    end = interval[-1]
+
+    while (t + step_size) <= end:
+        compute_slow_rates(t, states, rates, variables)
+        slow_deltas = [(index, rates[index] * step_size) for index in slow]
+
+        fast_t = t
+        for _ in range(ratio):
+            # The last coarse step is cut short to end where euler would, storing results at the same times.
+            if (fast_t + step_size) > end:
+                break
+
+            x.append(fast_t)
+            for index, value in enumerate(states):
+                results[index].append(value)
+
+            if pipeline is not None:
+                pipeline.push(x, results)
+
+            compute_fast_rates(fast_t, states, rates, variables)
+            fast_deltas = [(index, rates[index] * step_size) for index in fast]
+            for index, delta in fast_deltas:
+                states[index] += delta
+            for index, delta in slow_deltas:
+                states[index] += delta
+
+            fast_t += step_size
+
+        t = fast_t
+
+        if monitor is not None and monitor.update(t):
+            break
+
     return x, results
 
 
 def scipy_based_solver(system, method, simulation_parameters, external_module):
-    states, rates, variables = initialize_system(system)
+    states, rates, variables = initialize_system(system, simulation_parameters.get('initial_values'))
 
     step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(step_size, list):
         step_size = step_size[0]
@@ -61,7 +137,7 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
     x = []
 
     solver = ode(update)
-    solver.set_integrator(method)
+    solver.set_integrator(method, **simulation_parameters['integration'].get('integrator_options', {}))
     solver.set_initial_value(states, interval[0])
     solver.set_f_params(system, rates, variables)
 
@@ -77,4 +153,10 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
         for index, value in enumerate(solver.y):
             results[index].append(value)
 
+        if pipeline is not None:
+            pipeline.push(x, results)
+
+        if monitor is not None and monitor.update(solver.t):
+            break
+
     return x, results
@@ -1,14 +1,17 @@
 
 from scipy.integrate import ode
 
+from cellsolver.utilities import override_initial_values
 
-def initialize_system(system):
+
+def initialize_system(system, initial_values=None):
     rates = system.create_states_array()
     states = system.create_states_array()
     variables = system.create_variables_array()
     resets = system.create_resets_array()
 
     system.initialize_states_and_constants(states, variables)
+    override_initial_values(states, variables, initial_values)
     system.compute_computed_constants(variables)
 
     return states, rates, variables, resets
@@ -20,10 +23,12 @@ def update(voi, states, system, rates, variables):
 
 
 def euler_based_solver(system, simulation_parameters, external_module):
-    states, rates, variables, resets = initialize_system(system)
+    states, rates, variables, resets = initialize_system(system, simulation_parameters.get('initial_values'))
 
     step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(step_size, list):
         step_size = step_size[0]
@@ -42,6 +47,9 @@ def euler_based_solver(system, simulation_parameters, external_module):
         for index, value in enumerate(states):
             results[index].append(value)
 
+        if pipeline is not None:
+            pipeline.push(x, results)
+
         system.compute_rates(t, states, rates, variables)
 
         delta = list(map(lambda var: var * step_size, rates))
@@ -55,14 +63,19 @@ def euler_based_solver(system, simulation_parameters, external_module):
 
         t += step_size
 
+        if monitor is not None and monitor.update(t):
+            break
+
     return x, results
 
 
 def scipy_based_solver(system, method, simulation_parameters, external_module):
-    states, rates, variables, resets = initialize_system(system)
+    states, rates, variables, resets = initialize_system(system, simulation_parameters.get('initial_values'))
 
     step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(step_size, list):
         step_size = step_size[0]
@@ -71,7 +84,7 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
     x = []
 
     solver = ode(update)
-    solver.set_integrator(method)
+    solver.set_integrator(method, **simulation_parameters['integration'].get('integrator_options', {}))
     solver.set_initial_value(states, interval[0])
     solver.set_f_params(system, rates, variables)
 
@@ -99,4 +112,10 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
         for index, value in enumerate(solver.y):
             results[index].append(value)
 
+        if pipeline is not None:
+            pipeline.push(x, results)
+
+        if monitor is not None and monitor.update(solver.t):
+            break
+
     return x, results
@@ -1,14 +1,16 @@
 
-from cellsolver.solvers.version_0_1_0 import update, euler_based_solver, scipy_based_solver
+from cellsolver.solvers.version_0_1_0 import update, euler_based_solver, multirate_euler_based_solver, scipy_based_solver
 import cellsolver.solvers.version_0_1_0
+from cellsolver.utilities import override_initial_values
 
 
-def initialize_system(system):
+def initialize_system(system, initial_values=None):
     rates = system.create_states_array()
     states = system.create_states_array()
     variables = system.create_variables_array()
 
     system.initialise_states_and_constants(states, variables)
+    override_initial_values(states, variables, initial_values)
     system.compute_computed_constants(variables)
 
     return states, rates, variables
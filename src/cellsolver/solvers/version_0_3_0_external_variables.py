@@ -1,15 +1,17 @@
 
 from scipy.integrate import ode
 
-from cellsolver.utilities import apply_config
+from cellsolver.multirate import DEFAULT_RATIO, partition_states, partitioned_rates_functions
+from cellsolver.utilities import apply_config, override_initial_values
 
 
-def initialize_system(system, external_variable_function):
+def initialize_system(system, external_variable_function, initial_values=None):
     rates = system.create_states_array()
     states = system.create_states_array()
     variables = system.create_variables_array()
 
     system.initialise_states_and_constants(states, variables, external_variable_function)
+    override_initial_values(states, variables, initial_values)
     system.compute_computed_constants(variables)
 
     return states, rates, variables
@@ -28,11 +30,13 @@ def store_result(results, states, state_indices, variables, variable_indices):
 def euler_based_solver(system, simulation_parameters, external_module):
     state_indices = apply_config(simulation_parameters['result']['config'], system.STATE_INFO)
     variable_indices = apply_config(simulation_parameters['result']['config'], system.VARIABLE_INFO)
-    states, rates, variables = initialize_system(system, external_module.initialise_external_variable)
+    states, rates, variables = initialize_system(system, external_module.initialise_external_variable, simulation_parameters.get('initial_values'))
 
     step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
     output_step_size = simulation_parameters['result']['step_size']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(step_size, list):
         step_size = step_size[0]
@@ -56,6 +60,9 @@ def euler_based_solver(system, simulation_parameters, external_module):
             x.append(t)
             store_result(results, states, state_indices, variables, variable_indices)
 
+            if pipeline is not None:
+                pipeline.push(x, results)
+
         system.compute_rates(t, states, rates, variables, external_module.update_external_variable)
 
         delta = list(map(lambda var: var * step_size, rates))
@@ -63,8 +70,12 @@ def euler_based_solver(system, simulation_parameters, external_module):
 
         t += step_size
 
+        if monitor is not None and monitor.update(t):
+            # Return the partial results gathered so far.
+            return x, results
+
     # Always have last result in results.
-    if abs(x[-1] - end) > 1e-12:
+    if abs(result_epoch - end) > 1e-12:
         system.compute_rates(end, states, rates, variables, external_module.update_external_variable)
         system.compute_variables(end, states, rates, variables, external_module.update_external_variable)
         x.append(end)
@@ -73,6 +84,89 @@ def euler_based_solver(system, simulation_parameters, external_module):
     return x, results
 
 
+def multirate_euler_based_solver(system, simulation_parameters, external_module):
+    """Forward Euler with the fast states sub-stepped at the step size and the slow states stepped 'ratio' times coarser.
+
+    The slow rates are only computed once per coarse step, the slow states follow them linearly
+    during the fast sub-steps.
+    """
+    state_indices = apply_config(simulation_parameters['result']['config'], system.STATE_INFO)
+    variable_indices = apply_config(simulation_parameters['result']['config'], system.VARIABLE_INFO)
+    states, rates, variables = initialize_system(system, external_module.initialise_external_variable, simulation_parameters.get('initial_values'))
+
+    step_size = simulation_parameters['integration']['step_size']
+    interval = simulation_parameters['integration']['interval']
+    output_step_size = simulation_parameters['result']['step_size']
+    config = simulation_parameters['result']['config']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
+
+    if isinstance(step_size, list):
+        step_size = step_size[0]
+
+    if isinstance(output_step_size, list):
+        output_step_size = output_step_size[0]
+
+    ratio = config.get('multirate', {}).get('ratio', DEFAULT_RATIO)
+
+    update_external_variable = external_module.update_external_variable
+    fast, slow = partition_states(system, config, lambda y: update(interval[0], y, system, rates, variables, update_external_variable)[:], states)
+    compute_fast_rates, compute_slow_rates = partitioned_rates_functions(system, fast, slow)
+
+    results = [[] for _ in range(len(state_indices) + len(variable_indices))]
+    x = []
+
+    t = interval[0]
+    end = interval[-1]
+
+    result_epoch = interval[0]
+    while (t + step_size) < end:
+        compute_slow_rates(t, states, rates, variables, update_external_variable)
+        slow_deltas = [(index, rates[index] * step_size) for index in slow]
+
+        fast_t = t
+        for _ in range(ratio):
+            # The last coarse step is cut short to end where euler would.
+            if (fast_t + step_size) >= end:
+                break
+
+            # Results are checked for at every sub-step, so that they are stored at the same times as with euler.
+            if (result_epoch == interval[0]) or ((result_epoch + output_step_size) < fast_t):
+                result_epoch = fast_t
+                # Update computed variables to match current state.
+                system.compute_variables(fast_t, states, rates, variables, update_external_variable)
+                # Store current state.
+                x.append(fast_t)
+                store_result(results, states, state_indices, variables, variable_indices)
+
+                if pipeline is not None:
+                    pipeline.push(x, results)
+
+            compute_fast_rates(fast_t, states, rates, variables, update_external_variable)
+            fast_deltas = [(index, rates[index] * step_size) for index in fast]
+            for index, delta in fast_deltas:
+                states[index] += delta
+            for index, delta in slow_deltas:
+                states[index] += delta
+
+            fast_t += step_size
+
+        t = fast_t
+
+        if monitor is not None and monitor.update(t):
+            # Return the partial results gathered so far.
+            return x, results
+
+    # Always have last result in results.
+    if abs(result_epoch - end) > 1e-12:
+        system.compute_rates(end, states, rates, variables, update_external_variable)
+        system.compute_variables(end, states, rates, variables, update_external_variable)
+        x.append(end)
+        store_result(results, states, state_indices, variables, variable_indices)
+
+    return x, results
+
+
 def update(voi, states, system, rates, variables, update_external_variable):
     system.compute_rates(voi, states, rates, variables, update_external_variable)
     return rates
@@ -81,11 +175,13 @@ def update(voi, states, system, rates, variables, update_external_variable):
 def scipy_based_solver(system, method, simulation_parameters, external_module):
     state_indices = apply_config(simulation_parameters['result']['config'], system.STATE_INFO)
     variable_indices = apply_config(simulation_parameters['result']['config'], system.VARIABLE_INFO)
-    states, rates, variables = initialize_system(system, external_module.initialise_external_variable)
+    states, rates, variables = initialize_system(system, external_module.initialise_external_variable, simulation_parameters.get('initial_values'))
 
     # step_size = simulation_parameters['integration']['step_size']
     interval = simulation_parameters['integration']['interval']
     output_step_size = simulation_parameters['result']['step_size']
+    monitor = simulation_parameters.get('monitor')
+    pipeline = simulation_parameters.get('pipeline')
 
     if isinstance(output_step_size, list):
         output_step_size = output_step_size[0]
@@ -94,7 +190,8 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
     x = []
 
     solver = ode(update)
-    solver.set_integrator(method, max_step=1e-1)
+    integrator_options = {'max_step': 1e-1, **simulation_parameters['integration'].get('integrator_options', {})}
+    solver.set_integrator(method, **integrator_options)
     solver.set_initial_value(states, interval[0])
     solver.set_f_params(system, rates, variables, external_module.update_external_variable)
 
@@ -110,6 +207,13 @@ def scipy_based_solver(system, method, simulation_parameters, external_module):
         x.append(solver.t)
         store_result(results, solver.y, state_indices, variables, variable_indices)
 
+        if pipeline is not None:
+            pipeline.push(x, results)
+
+        if monitor is not None and monitor.update(solver.t):
+            # Return the partial results gathered so far.
+            return x, results
+
     solver.integrate(end)
     x.append(solver.t)
     store_result(results, solver.y, state_indices, variables, variable_indices)
@@ -1,6 +1,18 @@
+import gzip
+import hashlib
+import importlib.util
+import inspect
 import json
+import os
+import pickle
+import sys
+import tempfile
 import time
 
+import numpy as np
+
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cellsolver')
+
 
 class TimeExecution(object):
     number = 10
@@ -22,6 +34,84 @@ class TimeExecution(object):
         return self._f(*args, **kwargs)
 
 
+def module_from_file(module_name, file_path):
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    # Register the module so that objects defined in it, like VariableType, can be pickled.
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+_loaded_modules = {}
+
+
+def load_module_file(file_path):
+    """Load the module of Python code in the file, each file is only loaded once per process.
+
+    A module already imported from the file, like the code samples of this package, is used as it
+    is so that its objects pickle under the name they can be imported with.
+    """
+    if file_path not in _loaded_modules:
+        path = os.path.abspath(file_path)
+        imported = [module for module in list(sys.modules.values()) if getattr(module, '__file__', None) and os.path.abspath(module.__file__) == path]
+        if imported:
+            _loaded_modules[file_path] = imported[0]
+        else:
+            module_name = os.path.splitext(os.path.basename(file_path))[0]
+            _loaded_modules[file_path] = module_from_file(module_name, file_path)
+
+    return _loaded_modules[file_path]
+
+
+def full_path_to_file(arg):
+    expanded_path = os.path.expanduser(arg)
+    expanded_path = os.path.expandvars(expanded_path)
+    return os.path.abspath(expanded_path)
+
+
+def is_valid_file(arg):
+    full_path = full_path_to_file(arg)
+    if os.path.exists(full_path) and os.path.isfile(full_path):
+        return True
+
+    return False
+
+
+def possible_json_file(parser, arg):
+    if is_valid_file(arg):
+        full_path = full_path_to_file(arg)
+        try:
+            with open(full_path) as f:
+                content = f.read()
+
+            json.loads(content)
+            return full_path
+        except json.JSONDecodeError:
+            parser.error(f"The config file {arg} is not valid JSON!")
+    elif arg is None:
+        return ''
+
+    parser.error(f"The config file {arg} does not exist!")
+
+
+def existing_file(parser, arg):
+    if is_valid_file(arg):
+        return full_path_to_file(arg)
+
+    parser.error(f"The file {arg} does not exist!")
+
+
+def valid_module(parser, arg):
+    if is_valid_file(arg):
+        full_path = full_path_to_file(arg)
+        module_name = os.path.splitext(os.path.basename(full_path))[0]
+        loaded_module = module_from_file(module_name, full_path)
+        return loaded_module  # return the actual loaded module
+    else:
+        parser.error("The file %s does not exist!" % arg)
+
+
 def config_maker():
     d = {'plot_includes': ['sodium_channel_m_gate.m', 'sodium_channel_h_gate.h'], 'plot_excludes': ['intracellular_ions.nai', 'intracellular_ions.nass', 'intracellular_ions.cansr']}
     print(json.dumps(d))
@@ -66,3 +156,121 @@ def apply_config(config, y_info):
         indices = [x for x, z in enumerate(y_info) if not_matching_info_items(z, info_items)]
 
     return indices
+
+
+def override_initial_values(states, variables, initial_values):
+    """Override initial states and constants with the values given by index in the 'states' and 'variables' dicts of initial_values."""
+    if initial_values is None:
+        return
+
+    for index, value in initial_values.get('states', {}).items():
+        states[index] = value
+    for index, value in initial_values.get('variables', {}).items():
+        variables[index] = value
+
+
+def load_cache(cache_file):
+    """Load a JSON cache from the cellsolver cache directory, an empty cache if it does not exist or is invalid."""
+    cache_file = os.path.join(CACHE_DIRECTORY, cache_file)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            pass
+
+    return {}
+
+
+def save_cache(cache_file, cache):
+    """Save a JSON cache to the cellsolver cache directory.
+
+    The entries are merged into those saved by other processes since the cache was loaded, and
+    written to a temporary file that then replaces the cache file, so that processes reading the
+    cache while it is saved never see a partly written file.
+    """
+    cache = {**load_cache(cache_file), **cache}
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    cache_file = os.path.join(CACHE_DIRECTORY, cache_file)
+    file_descriptor, temporary_file = tempfile.mkstemp(dir=CACHE_DIRECTORY, prefix=os.path.basename(cache_file), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temporary_file, cache_file)
+    except BaseException:
+        os.remove(temporary_file)
+        raise
+
+
+def module_hash(module):
+    """Return a SHA-256 hex digest identifying the source of the given module."""
+    if getattr(module, '__file__', None) is not None:
+        with open(module.__file__, 'rb') as f:
+            content = f.read()
+    else:
+        content = inspect.getsource(module).encode()
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def solution_error(x, y_n, reference_x, reference_y_n):
+    """Maximum mixed absolute/relative error of a solution measured on the reference result grid.
+
+    The solution is linearly interpolated onto the reference grid, the error for each value is
+    taken as |y - y_ref| / (1 + |y_ref|).  A solution that is not finite, or that stops more than
+    one result step short of the end of the reference, has an infinite error.
+    """
+    if len(x) == 0:
+        return float('inf')
+    if len(reference_x) > 1 and x[-1] < reference_x[-1] - (reference_x[-1] - reference_x[-2]):
+        return float('inf')
+
+    error = 0.0
+    for y, reference_y in zip(y_n, reference_y_n):
+        reference_y = np.asarray(reference_y, dtype=float)
+        y = np.interp(reference_x, x, y)
+        if not np.all(np.isfinite(y)):
+            return float('inf')
+
+        error = max(error, float(np.max(np.abs(y - reference_y) / (1.0 + np.abs(reference_y)))))
+
+    return error
+
+
+def solution_info(system, config):
+    parameter_info = [*system.STATE_INFO, *system.VARIABLE_INFO]
+    indices = apply_config(config, parameter_info)
+    return [parameter_info[i] for i in indices]
+
+
+def save_solution(output_file, x, y_n, system, config):
+    with open(output_file, 'wb') as f:
+        pickle.dump({'x': x, 'x_info': system.VOI_INFO, 'y_n': y_n, 'y_n_info': solution_info(system, config), 'title': system.__name__}, f)
+
+
+def load_solution(output_file):
+    """Load a solution written by save_solution, or streamed by the result pipeline, as a dict."""
+    with open(output_file, 'rb') as f:
+        streamed = f.read(2) == b'\x1f\x8b'
+
+    if not streamed:
+        with open(output_file, 'rb') as f:
+            return pickle.load(f)
+
+    with gzip.open(output_file, 'rb') as f:
+        solution = pickle.load(f)
+        del solution['format']
+        solution['x'] = []
+        solution['y_n'] = []
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                break
+            if not solution['y_n']:
+                solution['y_n'] = [[] for _ in chunk['y_n']]
+            solution['x'].extend(chunk['x'])
+            for y, chunk_y in zip(solution['y_n'], chunk['y_n']):
+                y.extend(chunk_y)
+
+    return solution
@@ -0,0 +1,147 @@
+import argparse
+import functools
+import json
+import time
+
+from cellsolver.codesamples import hodgkin_huxley_squid_axon_model_1952 as hh
+from cellsolver.codesamples import simple_ode_with_resets
+from cellsolver.plot import plot_work_precision
+from cellsolver.solvers import SCIPY_SOLVERS, solve, system_solver
+from cellsolver.utilities import solution_error, valid_module
+
+BUNDLED_MODELS = [hh, simple_ode_with_resets]
+DEFAULT_STEP_SIZES = [0.05, 0.02, 0.01, 0.005, 0.002, 0.001]
+DEFAULT_TOLERANCES = [1e-3, 1e-4, 1e-5, 1e-6, 1e-7, 1e-8]
+REFERENCE_INTEGRATOR = ('lsoda', {'rtol': 1e-12, 'atol': 1e-12, 'nsteps': 1000000})
+
+
+class CountingSystem(object):
+    """Wrap a generated module and count the evaluations of compute_rates.
+
+    The partial compute_rates functions of the multirate solver are counted as evaluations too.
+    """
+
+    def __init__(self, system):
+        self._system = system
+        self.rhs_evaluations = 0
+        self.compute_rates = self.wrap_rates_function(system.compute_rates)
+
+    def __getattr__(self, name):
+        return getattr(self._system, name)
+
+    def wrap_rates_function(self, function):
+        @functools.wraps(function)
+        def counted_function(*args, **kwargs):
+            self.rhs_evaluations += 1
+            return function(*args, **kwargs)
+
+        return counted_function
+
+
+def _simulation_parameters(interval, step_size, result_step_size, integrator_options=None):
+    return {
+        'integration': {'step_size': step_size, 'interval': interval, 'integrator_options': integrator_options or {}},
+        'result': {'step_size': result_step_size, 'config': {}},
+    }
+
+
+def measure(system, solver, simulation_parameters, reference, external_module=None):
+    """Run a solver once and measure its error at the reference result grid, RHS evaluations and wall time."""
+    solver_module = system_solver(system)
+    counting_system = CountingSystem(system)
+    ts = time.perf_counter()
+    try:
+        x, y_n = solve(counting_system, solver, simulation_parameters, external_module, solver_module)
+    except (ArithmeticError, ValueError):
+        x = y_n = None
+    te = time.perf_counter()
+
+    error = float('inf') if x is None else solution_error(x, y_n, *reference)
+
+    return {'error': error, 'rhs_evaluations': counting_system.rhs_evaluations, 'time': te - ts}
+
+
+def work_precision(system, interval, result_step_size, step_sizes, tolerances, external_module=None):
+    """Measure every solver against a high accuracy reference solution of the system.
+
+    Euler and, where the system supports it, multirate are run for each of the step sizes and the
+    scipy solvers for each of the tolerances (used for both rtol and atol).  Returns a list of measurements, one for each run.
+    """
+    reference_solver, reference_options = REFERENCE_INTEGRATOR
+    reference = solve(system, reference_solver, _simulation_parameters(interval, result_step_size, result_step_size, reference_options), external_module)
+
+    runs = []
+    step_solvers = ['euler']
+    if hasattr(system_solver(system), 'multirate_euler_based_solver'):
+        step_solvers.append('multirate')
+    for solver in step_solvers:
+        for step_size in step_sizes:
+            simulation_parameters = _simulation_parameters(interval, step_size, result_step_size)
+            measurement = measure(system, solver, simulation_parameters, reference, external_module)
+            runs.append({'solver': solver, 'step_size': step_size, **measurement})
+
+    for solver in SCIPY_SOLVERS:
+        for tolerance in tolerances:
+            simulation_parameters = _simulation_parameters(interval, result_step_size, result_step_size, {'rtol': tolerance, 'atol': tolerance})
+            measurement = measure(system, solver, simulation_parameters, reference, external_module)
+            runs.append({'solver': solver, 'tolerance': tolerance, **measurement})
+
+    return runs
+
+
+def cheapest_run(runs, accuracy):
+    """Return the fastest run with an error within the accuracy budget, None if no run meets it."""
+    acceptable = [run for run in runs if run['error'] <= accuracy]
+    if acceptable:
+        return min(acceptable, key=lambda run: run['time'])
+
+    return None
+
+
+def process_arguments():
+    parser = argparse.ArgumentParser(prog='cellsolver work-precision',
+                                     description='Compare the work and precision of the solvers against a reference solution.')
+    parser.add_argument('--interval', action='store', type=float, nargs=2, default=[0.0, 100.0],
+                        help='interval to run the simulations for (default: [0.0, 100.0])')
+    parser.add_argument('--result-step-size', action='store', type=float, default=0.1,
+                        help='the result step size the error is measured at (default: 0.1)')
+    parser.add_argument('--step-sizes', action='store', type=float, nargs='+', default=DEFAULT_STEP_SIZES,
+                        help='the step sizes to run the euler and multirate solvers with (default: {0})'.format(DEFAULT_STEP_SIZES))
+    parser.add_argument('--tolerances', action='store', type=float, nargs='+', default=DEFAULT_TOLERANCES,
+                        help='the tolerances to run the scipy solvers with (default: {0})'.format(DEFAULT_TOLERANCES))
+    parser.add_argument('--accuracy', action='store', type=float, default=None,
+                        help='report the cheapest configuration with an error within this accuracy budget')
+    parser.add_argument('--output-file', default='work_precision.json',
+                        help='the JSON file to write the measurements to (default: work_precision.json)')
+    parser.add_argument('--plot-file', default=None,
+                        help='save the work-precision plot to this file instead of showing it')
+    parser.add_argument('--ext-var', nargs='?', default=None, type=lambda file_name: valid_module(parser, file_name),
+                        help='a module of Python code that supplies external variable functions for the modules')
+    parser.add_argument('module', nargs='*', type=lambda file_name: valid_module(parser, file_name),
+                        help='modules of Python code generated by libCellML (default: the bundled code samples)')
+
+    return parser
+
+
+def main(argv=None):
+    parser = process_arguments()
+    args = parser.parse_args(argv)
+
+    modules = args.module if args.module else BUNDLED_MODELS
+    measurements = {}
+    for module in modules:
+        runs = work_precision(module, args.interval, args.result_step_size, args.step_sizes, args.tolerances, args.ext_var)
+        measurements[module.__name__] = runs
+
+        if args.accuracy is not None:
+            run = cheapest_run(runs, args.accuracy)
+            if run is None:
+                print("{0}: no configuration meets the accuracy {1}.".format(module.__name__, args.accuracy))
+            else:
+                setting = 'step size {0}'.format(run['step_size']) if 'step_size' in run else 'tolerance {0}'.format(run['tolerance'])
+                print("{0}: '{1}' with {2} (error {3:.3g}, {4:.3g} s).".format(module.__name__, run['solver'], setting, run['error'], run['time']))
+
+    with open(args.output_file, 'w') as f:
+        json.dump(measurements, f, indent=2)
+
+    plot_work_precision(measurements, args.plot_file)